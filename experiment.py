@@ -1,74 +1,96 @@
 from src.retrieval import HybridRetriever, DenseRetriever, BM25Retriever
-from src.reranking import OnlineRelevanceEstimation
-from src.evaluation import calculate_recall, calculate_ndcg, calculate_precision
-from src.data import DatasetLoader
+from src.retrieval.bm25_retriever import index_key
+from src.retrieval.dense_retriever import (DEFAULT_MODEL, embedding_dimension, embedding_key, encode_documents,
+                                           start_encode_pool, stop_encode_pool)
+from src.retrieval.embedding_cache import EmbeddingWriter
+from src.retrieval.inverted_index import InvertedIndexBuilder, tokenize
+from src.retrieval.hybrid_retriever import FUSION_MODES
+from src.reranking import OnlineRelevanceEstimation, CrossEncoderReranker, DenseBlendReranker, rerank_many
+from src.evaluation import calculate_recall, calculate_ndcg, calculate_precision, read_run, run_path, write_run
+from src.data import DatasetLoader, DocumentStore
+from src.retrieval.storage import cache_key, corpus_fingerprint, index_directory
 import argparse
+import multiprocessing
+import os
+import sys
 import numpy as np
-from typing import Dict, List, Tuple
+from sentence_transformers import SentenceTransformer
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 
-def simple_rerank_model(ore_instance, documents: List[str], bm25_retriever, dense_retriever):
-    query_embedding_cache = {}
+def compare_fusion_modes(retriever, loader, doc_index, queries, bm25_batch, dense_batch, top_k: int):
+    print(f"\nFusion comparison over {len(queries)} queries (first stage only):")
+    print(f"  {'Fusion':<8} {f'Recall@{top_k}':<11} {f'NDCG@{top_k}':<10} Precision@{top_k}")
+    for mode in FUSION_MODES:
+        recalls, ndcgs, precisions = [], [], []
+        for (query_id, query_text), bm25_results, dense_results in zip(queries, bm25_batch, dense_batch):
+            relevant_indices = {doc_index[doc_id] for doc_id in loader.get_relevant_docs(query_id) if doc_id in doc_index}
+            if not relevant_indices:
+                continue
+            fused = retriever.fuse(bm25_results, dense_results, top_k, fusion=mode, query=query_text)
+            ranked = [idx for idx, _ in fused]
+            recalls.append(calculate_recall(ranked, relevant_indices, k=top_k))
+            ndcgs.append(calculate_ndcg(ranked, relevant_indices, k=top_k))
+            precisions.append(calculate_precision(ranked, relevant_indices, k=top_k))
+        print(f"  {mode:<8} {np.mean(recalls) if recalls else 0.0:<11.4f} "
+              f"{np.mean(ndcgs) if ndcgs else 0.0:<10.4f} {np.mean(precisions) if precisions else 0.0:.4f}")
+    sys.stdout.flush()
+
+
+def ingest_corpus(loader, dataset_name: str, limit: Optional[int], relevant_doc_ids: Set[str],
+                  encode_batch_size: int = 32, encode_workers: int = 1):
+    # Builds the document store, the BM25 postings and the document embeddings
+    # in one streaming pass over the collection, then saves the index and
+    # embeddings where BM25Retriever and DenseRetriever look for them.
+    # The store and the BM25 postings are rebuilt if a run is interrupted, but
+    # encoding, by far the slowest part, resumes after the rows already saved.
+    builder = InvertedIndexBuilder()
+    model = writer = pool = None
+    streamed = 0
     
-    def rerank(query, doc_indices):
-        new_scores = {}
-        
-        if not doc_indices:
-            return new_scores
-        
-        if query not in query_embedding_cache:
-            query_embedding_cache[query] = dense_retriever.model.encode(query, convert_to_numpy=True)
-        query_embedding = query_embedding_cache[query]
-        
-        tokenized_query = query.lower().split()
-        
-        batch_dense_scores = []
-        for doc_idx in doc_indices:
-            doc_embedding = dense_retriever.doc_embeddings[doc_idx]
-            dense_score = np.dot(doc_embedding, query_embedding) / (
-                np.linalg.norm(doc_embedding) * np.linalg.norm(query_embedding)
-            )
-            batch_dense_scores.append((doc_idx, dense_score))
-        
-        if batch_dense_scores:
-            dense_vals = [s[1] for s in batch_dense_scores]
-            dense_min, dense_max = min(dense_vals), max(dense_vals)
-            dense_range = dense_max - dense_min if dense_max > dense_min else 1.0
-            
-            for doc_idx, dense_score in batch_dense_scores:
-                current_score = ore_instance.current_scores.get(doc_idx, 0.0)
-                
-                norm_dense = (dense_score - dense_min) / dense_range if dense_range > 0 else 0.5
-                
-                if current_score < 0.3:
-                    new_score = 0.2 * current_score + 0.8 * norm_dense
-                elif current_score < 0.6:
-                    new_score = 0.4 * current_score + 0.6 * norm_dense
-                elif current_score < 0.85:
-                    new_score = 0.6 * current_score + 0.4 * norm_dense
-                else:
-                    new_score = 0.85 * current_score + 0.15 * norm_dense
-                
-                if new_score < current_score:
-                    new_score = current_score
-                
-                new_scores[doc_idx] = float(new_score)
-        
-        return new_scores
-    return rerank
+    def index_chunk(doc_ids: List[str], texts: List[str]):
+        builder.add(tokenize(text) for text in texts)
+    
+    def encode_chunk(doc_ids: List[str], texts: List[str]):
+        nonlocal model, writer, pool, streamed
+        if writer is None:
+            model = SentenceTransformer(DEFAULT_MODEL)
+            writer = EmbeddingWriter(f"{index_directory('data', 'embeddings', dataset_name, limit or 0)}.ingest",
+                                     embedding_dimension(model), capacity=(limit or 0) + len(relevant_doc_ids),
+                                     key=cache_key(model=DEFAULT_MODEL, dataset=dataset_name, limit=limit,
+                                                   relevant=corpus_fingerprint(sorted(relevant_doc_ids))))
+            if writer.rows:
+                print(f"\nResuming document encoding after {writer.rows:,} documents")
+                sys.stdout.flush()
+            pool = start_encode_pool(model, encode_workers)
+        start, streamed = streamed, streamed + len(texts)
+        if streamed <= writer.rows:
+            return
+        texts = texts[writer.rows - start:]
+        writer.append(encode_documents(model, texts, batch_size=encode_batch_size, pool=pool))
+    
+    try:
+        documents, doc_index = loader.load_document_store(limit, relevant_doc_ids,
+                                                          consumers=[index_chunk, encode_chunk])
+    finally:
+        if model is not None:
+            stop_encode_pool(model, pool)
+    if writer is None:
+        # The store was already on disk, so nothing was streamed.
+        return documents, doc_index
+    
+    index_dir = index_directory("data", "bm25", dataset_name, len(documents))
+    builder.build().save(str(index_dir), index_key(dataset_name, len(documents), documents.fingerprint))
+    print(f"Saved BM25 index to {index_dir}")
+    embedding_dir = index_directory("data", "embeddings", dataset_name, len(documents))
+    writer.close(str(embedding_dir), embedding_key(DEFAULT_MODEL, dataset_name, len(documents), documents.fingerprint))
+    print(f"Saved document embeddings to {embedding_dir}")
+    sys.stdout.flush()
+    return documents, doc_index
 
 
-def run_experiment(
-    dataset_name: str = "msmarco-passage/trec-dl-2019/judged",
-    num_queries: int = 10,
-    num_docs: int = 1000,
-    top_k: int = 20,
-    budget: int = 50,
-    alpha: float = 0.5,
-    batch_size: int = 10,
-    exploration_factor: float = 0.2,
-    use_bm25_baseline: bool = False
-):
+def load_corpus(dataset_name: str, num_docs: int, num_queries: int, document_store: bool = False,
+                index_cache: bool = True, encode_batch_size: int = 32, encode_workers: int = 1):
     print(f"Loading dataset: {dataset_name}")
     loader = DatasetLoader(dataset_name, data_dir="data")
     
@@ -76,7 +98,6 @@ def run_experiment(
     qrels = loader.load_qrels()
     
     print(f"\nLoading queries...")
-    import sys
     sys.stdout.flush()
     all_queries = loader.load_queries()
     
@@ -87,12 +108,15 @@ def run_experiment(
     if num_docs == 0:
         print(f"\nLoading all documents (including {len(all_relevant_doc_ids)} relevant documents)...")
         print("This may take 10-20 minutes for 8.8M documents...")
-        sys.stdout.flush()
-        documents, doc_index = loader.load_documents(limit=None, include_relevant_doc_ids=all_relevant_doc_ids)
     else:
         print(f"\nLoading {num_docs:,} documents (including {len(all_relevant_doc_ids)} relevant documents)...")
-        sys.stdout.flush()
-        documents, doc_index = loader.load_documents(limit=num_docs, include_relevant_doc_ids=all_relevant_doc_ids)
+    sys.stdout.flush()
+    if document_store and index_cache:
+        documents, doc_index = ingest_corpus(loader, dataset_name, num_docs or None, all_relevant_doc_ids,
+                                             encode_batch_size=encode_batch_size, encode_workers=encode_workers)
+    else:
+        documents, doc_index = loader.load_documents(limit=num_docs or None, include_relevant_doc_ids=all_relevant_doc_ids,
+                                                      store=document_store)
     print(f"Loaded {len(documents):,} documents")
     sys.stdout.flush()
     
@@ -104,28 +128,329 @@ def run_experiment(
     queries = list(queries_dict.items())[:num_queries]
     print(f"Using {len(queries)} queries with relevant documents")
     
+    return loader, documents, doc_index, queries
+
+
+def corpus_identity(documents, doc_index) -> Tuple[str, Callable[[int], str]]:
+    # A DocumentStore already knows its fingerprint and maps rows back to ids
+    # without inverting its index in memory.
+    if isinstance(documents, DocumentStore):
+        return documents.fingerprint, documents.doc_id
+    doc_ids = sorted(doc_index, key=doc_index.get)
+    return corpus_fingerprint(doc_ids), doc_ids.__getitem__
+
+
+def build_dense_retriever(
+    documents: List[str],
+    dataset_name: str,
+    fingerprint: str,
+    index_cache: bool = True,
+    normalize_embeddings: bool = False,
+    embedding_precision: str = "float32",
+    ann: Optional[str] = None,
+    nprobe: int = 16,
+    encode_batch_size: int = 32,
+    encode_workers: int = 1
+):
+    return DenseRetriever(
+        documents,
+        cache_dir=str(index_directory("data", "embeddings", dataset_name, len(documents))) if index_cache else None,
+        dataset_name=dataset_name,
+        fingerprint=fingerprint,
+        normalize=normalize_embeddings or ann is not None,
+        precision=embedding_precision,
+        ann=ann,
+        nprobe=nprobe,
+        batch_size=encode_batch_size,
+        encode_workers=encode_workers
+    )
+
+
+def build_retrievers(
+    documents: List[str],
+    doc_index: Dict[str, int],
+    queries: List[Tuple[str, str]],
+    dataset_name: str,
+    alpha: float = 0.5,
+    bm25_pruning: bool = True,
+    index_cache: bool = True,
+    normalize_embeddings: bool = False,
+    embedding_precision: str = "float32",
+    ann: Optional[str] = None,
+    nprobe: int = 16,
+    fusion: str = "minmax",
+    fingerprint: Optional[str] = None,
+    index_workers: int = 1,
+    encode_batch_size: int = 32,
+    encode_workers: int = 1
+):
+    if fingerprint is None:
+        fingerprint, _ = corpus_identity(documents, doc_index)
+    
     print("\nInitializing retrievers...")
     print("Step 1/3: Initializing BM25 retriever...")
     sys.stdout.flush()
-    bm25_retriever = BM25Retriever(documents)
+    bm25_retriever = BM25Retriever(
+        documents,
+        pruning=bm25_pruning,
+        index_dir=str(index_directory("data", "bm25", dataset_name, len(documents))) if index_cache else None,
+        dataset_name=dataset_name,
+        fingerprint=fingerprint,
+        workers=index_workers
+    )
     print("Step 2/3: Initializing Dense retriever (encoding documents - this may take time)...")
     sys.stdout.flush()
-    dense_retriever = DenseRetriever(documents)
-    print("Step 3/3: Initializing Hybrid retriever...")
+    dense_retriever = build_dense_retriever(
+        documents, dataset_name, fingerprint,
+        index_cache=index_cache,
+        normalize_embeddings=normalize_embeddings,
+        embedding_precision=embedding_precision,
+        ann=ann,
+        nprobe=nprobe,
+        encode_batch_size=encode_batch_size,
+        encode_workers=encode_workers
+    )
+    if ann is not None:
+        recall = dense_retriever.ann_recall([query_text for _, query_text in queries], k=100)
+        print(f"{ann.upper()} recall@100 against exact search (nprobe={nprobe}): {recall:.4f}")
+    print("Step 3/3: Initializing Hybrid retriever (sharing the BM25 and Dense indexes)...")
     sys.stdout.flush()
-    retriever = HybridRetriever(documents, alpha=alpha)
+    retriever = HybridRetriever(
+        documents,
+        alpha=alpha,
+        bm25_retriever=bm25_retriever,
+        dense_retriever=dense_retriever,
+        fusion=fusion
+    )
     print("All retrievers initialized!")
     sys.stdout.flush()
     
+    return bm25_retriever, dense_retriever, retriever
+
+
+def build_rerank_model(reranker: str, documents: List[str], dense_retriever,
+                       cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                       reranker_threads: Optional[int] = None):
+    if reranker == "cross-encoder":
+        print(f"Loading cross-encoder reranker: {cross_encoder_model}")
+        sys.stdout.flush()
+        return CrossEncoderReranker(documents, model_name=cross_encoder_model, num_threads=reranker_threads)
+    return DenseBlendReranker(dense_retriever)
+
+
+def normalize_initial_scores(initial_results: List[Tuple[int, float]]) -> Dict[int, float]:
+    if not initial_results:
+        return {}
+    initial_indices = np.array([idx for idx, _ in initial_results], dtype=np.int64)
+    initial_values = np.array([score for _, score in initial_results], dtype=np.float64)
+    min_score, max_score = initial_values.min(), initial_values.max()
+    score_range = max_score - min_score if max_score > min_score else 1.0
+    return dict(zip(initial_indices.tolist(), ((initial_values - min_score) / score_range).tolist()))
+
+
+def run_ore(
+    tasks: List[Tuple[str, Dict[int, float]]],
+    documents: List[str],
+    rerank_model,
+    budget: int,
+    top_k: int,
+    batch_size: int,
+    exploration_factor: float,
+    in_flight: int
+) -> List[List[Tuple[int, float]]]:
+    ores = []
+    for query_text, initial_scores in tasks:
+        ore = OnlineRelevanceEstimation(
+            documents=documents,
+            initial_scores=initial_scores,
+            rerank_model=rerank_model,
+            batch_size=batch_size,
+            exploration_factor=exploration_factor,
+            corpus_size=len(documents),
+            max_in_flight=in_flight
+        )
+        ores.append(ore)
+    return rerank_many(ores, [query_text for query_text, _ in tasks], budget=budget, depth=top_k)
+
+
+# Set by run_ore_parallel just before forking; workers inherit the documents,
+# memory-mapped indexes and rerank model from it instead of pickling them.
+_ORE_CONTEXT = {}
+
+
+def fork_workers(workers: int) -> int:
+    # Worker pools fork so children inherit the parent's indexes and models;
+    # without fork (Windows) the work runs in this process instead.
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print(f"--workers {workers} needs the 'fork' start method, which this platform lacks; using 1 process")
+        sys.stdout.flush()
+        return 1
+    return workers
+
+
+def init_worker_threads(num_threads: int):
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def _run_ore_chunk(tasks):
+    return run_ore(tasks, **_ORE_CONTEXT)
+
+
+def run_ore_parallel(tasks: List[Tuple[str, Dict[int, float]]], workers: int = 1,
+                     num_threads: Optional[int] = None, **context) -> List[List[Tuple[int, float]]]:
+    workers = min(fork_workers(workers), len(tasks))
+    if workers <= 1:
+        return run_ore(tasks, **context)
+
+    _ORE_CONTEXT.update(context)
+    chunks = [tasks[worker::workers] for worker in range(workers)]
+    num_threads = num_threads or max(1, (os.cpu_count() or 1) // workers)
+    try:
+        with multiprocessing.get_context("fork").Pool(workers, init_worker_threads, (num_threads,)) as pool:
+            chunk_rankings = pool.map(_run_ore_chunk, chunks)
+    finally:
+        _ORE_CONTEXT.clear()
+
+    rankings = [None] * len(tasks)
+    for worker, chunk in enumerate(chunk_rankings):
+        rankings[worker::workers] = chunk
+    return rankings
+
+
+def run_experiment(
+    dataset_name: str = "msmarco-passage/trec-dl-2019/judged",
+    num_queries: int = 10,
+    num_docs: int = 1000,
+    top_k: int = 20,
+    budget: int = 50,
+    alpha: float = 0.5,
+    batch_size: int = 10,
+    exploration_factor: float = 0.2,
+    use_bm25_baseline: bool = False,
+    bm25_pruning: bool = True,
+    index_cache: bool = True,
+    normalize_embeddings: bool = False,
+    embedding_precision: str = "float32",
+    ann: Optional[str] = None,
+    nprobe: int = 16,
+    fusion: str = "minmax",
+    compare_fusion: bool = False,
+    in_flight: int = 1,
+    workers: int = 1,
+    reranker: str = "dense",
+    cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    reranker_threads: Optional[int] = None,
+    initial_run: Optional[str] = None,
+    save_runs: bool = False,
+    document_store: bool = False,
+    index_workers: int = 1,
+    encode_batch_size: int = 32,
+    encode_workers: int = 1
+):
+    if compare_fusion and (use_bm25_baseline or initial_run is not None):
+        raise ValueError("compare_fusion needs the hybrid first stage, not a BM25 baseline or an initial run")
+    loader, documents, doc_index, queries = load_corpus(dataset_name, num_docs, num_queries,
+                                                        document_store=document_store, index_cache=index_cache,
+                                                        encode_batch_size=encode_batch_size,
+                                                        encode_workers=encode_workers)
+    fingerprint, row_doc_id = corpus_identity(documents, doc_index)
+    
+    if initial_run is None:
+        bm25_retriever, dense_retriever, retriever = build_retrievers(
+            documents, doc_index, queries, dataset_name,
+            alpha=alpha,
+            bm25_pruning=bm25_pruning,
+            index_cache=index_cache,
+            normalize_embeddings=normalize_embeddings,
+            embedding_precision=embedding_precision,
+            ann=ann,
+            nprobe=nprobe,
+            fusion=fusion,
+            fingerprint=fingerprint,
+            index_workers=index_workers,
+            encode_batch_size=encode_batch_size,
+            encode_workers=encode_workers
+        )
+    else:
+        # A saved first stage needs no BM25 index; only the dense reranker
+        # still reads the document embeddings.
+        dense_retriever = None
+        if reranker == "dense":
+            print("\nInitializing Dense retriever (document embeddings for the dense reranker)...")
+            sys.stdout.flush()
+            dense_retriever = build_dense_retriever(
+                documents, dataset_name, fingerprint,
+                index_cache=index_cache,
+                normalize_embeddings=normalize_embeddings,
+                embedding_precision=embedding_precision,
+                encode_batch_size=encode_batch_size,
+                encode_workers=encode_workers
+            )
+    
+    rerank_model = build_rerank_model(reranker, documents, dense_retriever,
+                                      cross_encoder_model=cross_encoder_model, reranker_threads=reranker_threads)
+    
     results = {
         'baseline': {'recall': [], 'ndcg': [], 'precision': []},
         'ore': {'recall': [], 'ndcg': [], 'precision': []}
     }
     
+    retrieval_depth = min(len(documents), 10000)
+    query_texts = [query_text for _, query_text in queries]
+    if initial_run is not None:
+        baseline_name = f"run file {os.path.basename(initial_run)}"
+        first_stage_config = {"initial_run": os.path.abspath(initial_run)}
+    elif use_bm25_baseline:
+        baseline_name = "BM25-only"
+        first_stage_config = {"retriever": "bm25", "depth": retrieval_depth}
+    else:
+        baseline_name = f"Hybrid (BM25+Dense, {fusion})"
+        first_stage_config = {
+            "retriever": "hybrid", "depth": retrieval_depth, "alpha": alpha, "fusion": fusion,
+            "model": dense_retriever.model_name, "normalize_embeddings": normalize_embeddings or ann is not None,
+            "embedding_precision": embedding_precision, "ann": ann, "nprobe": nprobe if ann else None
+        }
+    
+    if initial_run is not None:
+        print(f"\nReading first-stage rankings from {initial_run}...")
+        sys.stdout.flush()
+        run = read_run(initial_run)
+        first_stage_results = [
+            [(doc_index[doc_id], score) for doc_id, score in run.get(query_id, []) if doc_id in doc_index]
+            for query_id, _ in queries
+        ]
+    elif use_bm25_baseline:
+        print(f"\nRunning first-stage retrieval ({baseline_name}) for {len(queries)} queries...")
+        sys.stdout.flush()
+        first_stage_results = bm25_retriever.retrieve_batch(query_texts, top_k=retrieval_depth)
+    else:
+        print(f"\nRunning first-stage retrieval ({baseline_name}) for {len(queries)} queries...")
+        sys.stdout.flush()
+        bm25_batch, dense_batch = retriever.retrieve_components(query_texts, top_k=retrieval_depth * 2)
+        first_stage_results = [
+            retriever.fuse(bm25_results, dense_results, retrieval_depth, query=query_text)
+            for query_text, bm25_results, dense_results in zip(query_texts, bm25_batch, dense_batch)
+        ]
+        if compare_fusion:
+            compare_fusion_modes(retriever, loader, doc_index, queries, bm25_batch, dense_batch, top_k)
+    
+    if save_runs and initial_run is None:
+        path = run_path("data", "first-stage", dataset_name, len(documents),
+                        fingerprint=fingerprint, **first_stage_config)
+        write_run(path, {
+            query_id: [(row_doc_id(idx), score) for idx, score in results_for_query]
+            for (query_id, _), results_for_query in zip(queries, first_stage_results)
+        }, tag="first-stage", config=first_stage_config)
+        print(f"Saved first-stage run to {path}")
+    
     print(f"\nRunning experiments on {len(queries)} queries...")
     print("=" * 80)
     sys.stdout.flush()
     
+    evaluated = []
+    ore_tasks = []
+    
     for query_idx, (query_id, query_text) in enumerate(queries, 1):
         print(f"\n[{query_idx}/{len(queries)}] Processing query...")
         sys.stdout.flush()
@@ -142,32 +467,15 @@ def run_experiment(
         if not relevant_indices:
             continue
         
-        if use_bm25_baseline:
-            initial_results = bm25_retriever.retrieve(query_text, top_k=min(len(documents), 10000))
-            baseline_name = "BM25-only"
-        else:
-            initial_results = retriever.retrieve(query_text, top_k=min(len(documents), 10000))
-            baseline_name = "Hybrid (BM25+Dense)"
-        
-        initial_scores_dict = {idx: score for idx, score in initial_results}
+        initial_results = first_stage_results[query_idx - 1]
+        if not initial_results:
+            print("  Skipping: No first-stage results")
+            continue
         
         print(f"  Retrieved {len(initial_results)} documents for initial ranking ({baseline_name})")
         sys.stdout.flush()
         
-        if initial_scores_dict:
-            min_score = min(initial_scores_dict.values())
-            max_score = max(initial_scores_dict.values())
-            score_range = max_score - min_score if max_score > min_score else 1.0
-        else:
-            min_score, max_score, score_range = 0.0, 1.0, 1.0
-        
-        initial_scores = {}
-        for i in range(len(documents)):
-            if i in initial_scores_dict:
-                normalized_score = (initial_scores_dict[i] - min_score) / score_range if score_range > 0 else 0.5
-                initial_scores[i] = float(normalized_score)
-            else:
-                initial_scores[i] = 0.0
+        initial_scores = normalize_initial_scores(initial_results)
         
         ranked_docs_baseline = [idx for idx, _ in initial_results[:top_k]]
         
@@ -175,9 +483,7 @@ def run_experiment(
         baseline_ndcg = calculate_ndcg(ranked_docs_baseline, relevant_indices, k=top_k)
         baseline_precision = calculate_precision(ranked_docs_baseline, relevant_indices, k=top_k)
         
-        results['baseline']['recall'].append(baseline_recall)
-        results['baseline']['ndcg'].append(baseline_ndcg)
-        results['baseline']['precision'].append(baseline_precision)
+        baseline = (baseline_recall, baseline_ndcg, baseline_precision)
         
         print(f"  Baseline - Recall@{top_k}: {baseline_recall:.4f}, "
               f"NDCG@{top_k}: {baseline_ndcg:.4f}, "
@@ -188,34 +494,55 @@ def run_experiment(
         
         if baseline_ndcg >= 0.995:
             print(f"  Skipping ORE: Baseline already perfect (NDCG@{top_k} = {baseline_ndcg:.4f})")
-            results['ore']['recall'].append(baseline_recall)
-            results['ore']['ndcg'].append(baseline_ndcg)
-            results['ore']['precision'].append(baseline_precision)
-            print(f"  ORE      - Recall@{top_k}: {baseline_recall:.4f}, "
-                  f"NDCG@{top_k}: {baseline_ndcg:.4f}, "
-                  f"Precision@{top_k}: {baseline_precision:.4f}")
-            print(f"  Improvement - Recall: +0.0000, NDCG: +0.0000, Precision: +0.0000")
+            evaluated.append((query_idx, query_id, relevant_indices, baseline, None))
             continue
         
-        print(f"  Running ORE reranking (budget: {budget})...")
-        sys.stdout.flush()
-        ore = OnlineRelevanceEstimation(
-            documents=documents,
-            initial_scores=initial_scores,
-            rerank_model=None,
-            batch_size=batch_size,
-            exploration_factor=exploration_factor
-        )
-        ore.rerank_model = simple_rerank_model(ore, documents, bm25_retriever, dense_retriever)
-        
-        final_ranking = ore.rerank(query_text, budget=budget, verbose=False)
-        print(f"  ORE reranking complete!")
-        sys.stdout.flush()
-        ranked_docs_ore = [idx for idx, _ in final_ranking]
+        evaluated.append((query_idx, query_id, relevant_indices, baseline, len(ore_tasks)))
+        ore_tasks.append((query_text, initial_scores))
+    
+    print(f"\nRunning ORE reranking for {len(ore_tasks)} queries (budget: {budget}, workers: {workers})...")
+    sys.stdout.flush()
+    ore_rankings = run_ore_parallel(
+        ore_tasks,
+        workers=workers,
+        num_threads=reranker_threads,
+        documents=documents,
+        rerank_model=rerank_model,
+        budget=budget,
+        top_k=top_k,
+        batch_size=batch_size,
+        exploration_factor=exploration_factor,
+        in_flight=in_flight
+    )
+    print(f"ORE reranking complete!")
+    
+    if save_runs:
+        ore_config = dict(first_stage_config, reranker=reranker, budget=budget, top_k=top_k, batch_size=batch_size,
+                          exploration=exploration_factor, in_flight=in_flight,
+                          cross_encoder_model=cross_encoder_model if reranker == "cross-encoder" else None)
+        path = run_path("data", "ore", dataset_name, len(documents),
+                        fingerprint=fingerprint, **ore_config)
+        write_run(path, {
+            query_id: [(row_doc_id(idx), score) for idx, score in
+                       (first_stage_results[query_idx - 1][:top_k] if ore_slot is None else ore_rankings[ore_slot])]
+            for query_idx, query_id, _, _, ore_slot in evaluated
+        }, tag="ore", config=ore_config)
+        print(f"Saved ORE run to {path}")
+    
+    for query_idx, query_id, relevant_indices, baseline, ore_slot in evaluated:
+        baseline_recall, baseline_ndcg, baseline_precision = baseline
+        results['baseline']['recall'].append(baseline_recall)
+        results['baseline']['ndcg'].append(baseline_ndcg)
+        results['baseline']['precision'].append(baseline_precision)
         
-        ore_recall = calculate_recall(ranked_docs_ore, relevant_indices, k=top_k)
-        ore_ndcg = calculate_ndcg(ranked_docs_ore, relevant_indices, k=top_k)
-        ore_precision = calculate_precision(ranked_docs_ore, relevant_indices, k=top_k)
+        print(f"\n[{query_idx}/{len(queries)}] Query ID: {query_id}")
+        if ore_slot is None:
+            ore_recall, ore_ndcg, ore_precision = baseline
+        else:
+            ranked_docs_ore = [idx for idx, _ in ore_rankings[ore_slot]]
+            ore_recall = calculate_recall(ranked_docs_ore, relevant_indices, k=top_k)
+            ore_ndcg = calculate_ndcg(ranked_docs_ore, relevant_indices, k=top_k)
+            ore_precision = calculate_precision(ranked_docs_ore, relevant_indices, k=top_k)
         
         results['ore']['recall'].append(ore_recall)
         results['ore']['ndcg'].append(ore_ndcg)
@@ -257,8 +584,6 @@ def run_experiment(
     ndcg_pct = (ndcg_improvement / baseline_ndcg_avg * 100) if baseline_ndcg_avg > 0 else 0
     precision_pct = (precision_improvement / baseline_precision_avg * 100) if baseline_precision_avg > 0 else 0
     
-    baseline_name = "BM25-only" if use_bm25_baseline else "Hybrid (BM25+Dense)"
-    
     print(f"\nBaseline ({baseline_name}):")
     print(f"  Average Recall@{top_k}:    {baseline_recall_avg:.4f}")
     print(f"  Average NDCG@{top_k}:     {baseline_ndcg_avg:.4f}")
@@ -298,8 +623,50 @@ def main():
                        help="ORE exploration factor")
     parser.add_argument("--bm25-baseline", action="store_true",
                        help="Use BM25-only as baseline (weaker, shows more improvement)")
+    parser.add_argument("--bm25-exhaustive", action="store_true",
+                       help="Score every posting instead of MaxScore top-k pruning")
+    parser.add_argument("--no-index-cache", action="store_true",
+                       help="Always rebuild indexes and embeddings instead of reusing the copies saved under data/indexes")
+    parser.add_argument("--normalize-embeddings", action="store_true",
+                       help="Store L2-normalized document embeddings so cosine is a plain dot product")
+    parser.add_argument("--embedding-precision", type=str, default="float32",
+                       choices=["float32", "float16", "int8"],
+                       help="Storage precision of the document embedding matrix")
+    parser.add_argument("--ann", type=str, default=None, choices=["ivf", "ivfpq"],
+                       help="Approximate nearest neighbour index for dense retrieval (implies --normalize-embeddings)")
+    parser.add_argument("--nprobe", type=int, default=16,
+                       help="Number of IVF lists probed per query")
+    parser.add_argument("--fusion", type=str, default="minmax", choices=list(FUSION_MODES),
+                       help="Hybrid score fusion: min-max, z-score, reciprocal rank fusion or convex with fixed bounds")
+    parser.add_argument("--compare-fusion", action="store_true",
+                       help="Also report first-stage metrics for every fusion mode")
+    parser.add_argument("--in-flight", type=int, default=1,
+                       help="ORE reranker batches scored concurrently (1 = sequential and deterministic)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Processes that run ORE for different queries in parallel")
+    parser.add_argument("--reranker", type=str, default="dense", choices=["dense", "cross-encoder"],
+                       help="ORE rerank model: dense cosine blend or a cross-encoder")
+    parser.add_argument("--cross-encoder-model", type=str, default="cross-encoder/ms-marco-MiniLM-L-6-v2",
+                       help="Cross-encoder model used with --reranker cross-encoder")
+    parser.add_argument("--reranker-threads", type=int, default=None,
+                       help="Torch CPU threads for the cross-encoder (default: torch's choice)")
+    parser.add_argument("--initial-run", type=str, default=None,
+                       help="TREC run file used as the first-stage ranking instead of building the retrievers")
+    parser.add_argument("--index-workers", type=int, default=1,
+                       help="Processes that tokenize and build BM25 postings for document shards in parallel")
+    parser.add_argument("--encode-workers", type=int, default=1,
+                       help="Processes encoding documents with the sentence-transformers multi-process pool")
+    parser.add_argument("--encode-batch-size", type=int, default=32,
+                       help="Batch size for encoding documents")
+    parser.add_argument("--document-store", action="store_true",
+                       help="Keep documents in a memory-mapped store under data/indexes/docstore instead of in RAM")
+    parser.add_argument("--save-runs", action="store_true",
+                       help="Write the first-stage and ORE rankings as TREC run files under data/runs")
     
     args = parser.parse_args()
+    if args.compare_fusion and (args.bm25_baseline or args.initial_run):
+        parser.error("--compare-fusion needs the hybrid first stage; it cannot be combined with "
+                     "--bm25-baseline or --initial-run")
     
     run_experiment(
         dataset_name=args.dataset,
@@ -310,7 +677,26 @@ def main():
         alpha=args.alpha,
         batch_size=args.batch_size,
         exploration_factor=args.exploration,
-        use_bm25_baseline=args.bm25_baseline
+        use_bm25_baseline=args.bm25_baseline,
+        bm25_pruning=not args.bm25_exhaustive,
+        index_cache=not args.no_index_cache,
+        normalize_embeddings=args.normalize_embeddings,
+        embedding_precision=args.embedding_precision,
+        ann=args.ann,
+        nprobe=args.nprobe,
+        fusion=args.fusion,
+        compare_fusion=args.compare_fusion,
+        in_flight=args.in_flight,
+        workers=args.workers,
+        reranker=args.reranker,
+        cross_encoder_model=args.cross_encoder_model,
+        reranker_threads=args.reranker_threads,
+        initial_run=args.initial_run,
+        save_runs=args.save_runs,
+        document_store=args.document_store,
+        index_workers=args.index_workers,
+        encode_batch_size=args.encode_batch_size,
+        encode_workers=args.encode_workers
     )
 
 
@@ -1,4 +1,7 @@
 from .dataset_loader import DatasetLoader, set_data_directory
+from .document_store import DocIdIndex, DocumentStore, DocumentStoreWriter, build_document_store, load_document_store
+from .ingestion import ingest, iter_chunks
 
-__all__ = ['DatasetLoader', 'set_data_directory']
+__all__ = ['DatasetLoader', 'set_data_directory', 'DocIdIndex', 'DocumentStore', 'DocumentStoreWriter',
+           'build_document_store', 'load_document_store', 'ingest', 'iter_chunks']
 
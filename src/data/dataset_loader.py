@@ -1,7 +1,10 @@
 import os
 from pathlib import Path
-from typing import List, Dict, Set, Tuple, Optional
+from typing import Iterable, Iterator, List, Dict, Sequence, Set, Tuple, Optional
 from tqdm import tqdm
+from .document_store import DocumentStoreWriter, load_document_store
+from .ingestion import ChunkConsumer, ingest
+from ..retrieval.storage import cache_key, corpus_fingerprint, index_directory
 
 def set_data_directory(data_dir: str = "data"):
     data_path = Path(data_dir).resolve()
@@ -21,11 +24,25 @@ class DatasetLoader:
         self.data_dir = data_dir
         self.dataset = ir_datasets.load(dataset_name)
         self._documents_cache = None
+        self._corpus_cache = {}
         self._queries_cache = None
         self._qrels_cache = None
     
-    def load_documents(self, limit: Optional[int] = None, include_relevant_doc_ids: Optional[Set[str]] = None) -> Tuple[List[str], Dict[str, int]]:
-        if self._documents_cache is not None and include_relevant_doc_ids is None:
+    def load_documents(self, limit: Optional[int] = None, include_relevant_doc_ids: Optional[Set[str]] = None,
+                       store: bool = False) -> Tuple[List[str], Dict[str, int]]:
+        if store:
+            return self.load_document_store(limit, include_relevant_doc_ids)
+        
+        if include_relevant_doc_ids is not None:
+            # The sample plus the judged documents is cached on disk by
+            # (dataset, limit, judged ids), and in memory for repeat calls.
+            key = (limit, corpus_fingerprint(sorted(include_relevant_doc_ids)))
+            if key not in self._corpus_cache:
+                doc_store, _ = self.load_document_store(limit, include_relevant_doc_ids)
+                self._corpus_cache[key] = (list(doc_store), {doc_id: idx for idx, doc_id in enumerate(doc_store.index)})
+            return self._corpus_cache[key]
+        
+        if self._documents_cache is not None:
             docs, doc_index = self._documents_cache
             if limit:
                 limited_docs = docs[:limit]
@@ -50,23 +67,46 @@ class DatasetLoader:
                 documents.append(doc.text)
                 doc_index[doc.doc_id] = i
         
-        if include_relevant_doc_ids:
-            docs_store = self.dataset.docs_store()
-            for doc_id in tqdm(include_relevant_doc_ids, desc="Loading relevant documents"):
-                if doc_id not in doc_index:
-                    try:
-                        doc = docs_store.get(doc_id)
-                        if doc:
-                            idx = len(documents)
-                            documents.append(doc.text)
-                            doc_index[doc_id] = idx
-                    except:
-                        pass
-        
-        if include_relevant_doc_ids is None:
-            self._documents_cache = (documents, doc_index)
+        self._documents_cache = (documents, doc_index)
         return documents, doc_index
     
+    def load_document_store(self, limit: Optional[int] = None, include_relevant_doc_ids: Optional[Set[str]] = None,
+                            consumers: Sequence[ChunkConsumer] = ()):
+        # `consumers` see every chunk of the pass that builds the store, so
+        # indexes can be built from the same read of the collection.
+        relevant_doc_ids = sorted(include_relevant_doc_ids or ())
+        key = cache_key(dataset=self.dataset_name, limit=limit, relevant=corpus_fingerprint(relevant_doc_ids))
+        path = index_directory(self.data_dir, "docstore", self.dataset_name, limit or 0)
+        documents = load_document_store(path, key)
+        if documents is None:
+            writer = DocumentStoreWriter(path)
+            ingest(self._iter_documents(limit, relevant_doc_ids), [writer.add, *consumers], total=limit)
+            documents = writer.close(key)
+        return documents, documents.index
+    
+    def _iter_documents(self, limit: Optional[int], relevant_doc_ids: List[str]) -> Iterator[Tuple[str, str]]:
+        # Only the judged ids are tracked, so the full collection streams
+        # straight into the store without an in-memory id set.
+        missing = set(relevant_doc_ids)
+        for i, doc in enumerate(self.dataset.docs_iter()):
+            if limit and i >= limit:
+                break
+            missing.discard(doc.doc_id)
+            yield doc.doc_id, doc.text
+        
+        if missing:
+            yield from self.get_documents(sorted(missing)).items()
+    
+    def get_documents(self, doc_ids: Iterable[str]) -> Dict[str, str]:
+        # ir_datasets' lookup sorts the requested ids by their position in the
+        # docstore and reads them in one forward sweep, instead of a seek per
+        # id. The result follows the requested order; ids the collection does
+        # not have are left out.
+        doc_ids = list(dict.fromkeys(doc_ids))
+        docs = self.dataset.docs_store().get_many_iter(sorted(doc_ids))
+        found = {doc.doc_id: doc.text for doc in tqdm(docs, desc="Loading relevant documents", total=len(doc_ids))}
+        return {doc_id: found[doc_id] for doc_id in doc_ids if doc_id in found}
+    
     def load_queries(self, limit: Optional[int] = None) -> Dict[str, str]:
         if self._queries_cache is not None:
             items = list(self._queries_cache.items())
@@ -110,13 +150,9 @@ class DatasetLoader:
         return qrels
     
     def get_document_by_id(self, doc_id: str) -> Optional[str]:
-        if self._documents_cache is None:
-            self.load_documents()
-        
         try:
-            doc = self.dataset.docs_store().get(doc_id)
-            return doc.text if doc else None
-        except:
+            return self.dataset.docs_store().get(doc_id).text
+        except KeyError:
             return None
     
     def get_query_by_id(self, query_id: str) -> Optional[str]:
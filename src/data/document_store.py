@@ -0,0 +1,163 @@
+import hashlib
+from array import array
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .ingestion import iter_chunks
+from ..retrieval.storage import publish_directory, read_meta, staging_directory, write_meta
+
+
+STORE_FORMAT = 1
+
+
+class DocIdIndex(Mapping):
+    # Maps doc ids to rows through a sorted id array, so lookups are a
+    # binary search over memory-mapped data instead of an 8.8M-entry dict.
+    def __init__(self, doc_ids: np.ndarray, sorted_ids: np.ndarray, sorted_rows: np.ndarray):
+        self.doc_ids = doc_ids
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self.doc_ids), 65536):
+            for doc_id in self.doc_ids[start:start + 65536].tolist():
+                yield doc_id.decode('utf-8')
+
+    def __getitem__(self, doc_id: str) -> int:
+        row = self._find(doc_id)
+        if row < 0:
+            raise KeyError(doc_id)
+        return row
+
+    def __contains__(self, doc_id) -> bool:
+        return isinstance(doc_id, str) and self._find(doc_id) >= 0
+
+    def _find(self, doc_id: str) -> int:
+        key = doc_id.encode('utf-8')
+        if not len(self.sorted_ids) or len(key) > self.sorted_ids.dtype.itemsize:
+            return -1
+        pos = int(np.searchsorted(self.sorted_ids, key))
+        if pos < len(self.sorted_ids) and self.sorted_ids[pos] == key:
+            return int(self.sorted_rows[pos])
+        return -1
+
+    def doc_id(self, row: int) -> str:
+        return self.doc_ids[row].decode('utf-8')
+
+
+class DocumentStore(Sequence):
+    def __init__(self, path: str):
+        path = Path(path)
+        self.path = path
+        self.meta = read_meta(path)
+        self.offsets = np.load(path / "offsets.npy", mmap_mode='r')
+        if self.offsets[-1] > 0:
+            self.texts = np.memmap(path / "texts.bin", dtype=np.uint8, mode='r')
+        else:
+            self.texts = np.zeros(0, dtype=np.uint8)
+        self.index = DocIdIndex(
+            np.load(path / "doc_ids.npy", mmap_mode='r'),
+            np.load(path / "sorted_ids.npy", mmap_mode='r'),
+            np.load(path / "sorted_rows.npy", mmap_mode='r')
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        return self.meta["fingerprint"]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            # One read covers the whole range; it is split by the offsets.
+            offsets = np.asarray(self.offsets[start:stop + 1]) - self.offsets[start]
+            blob = self.texts[self.offsets[start]:self.offsets[stop]].tobytes()
+            return [blob[begin:end].decode('utf-8') for begin, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Document index {index} out of range")
+        return self.texts[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self), 4096):
+            yield from self[start:start + 4096]
+
+    def doc_id(self, row: int) -> str:
+        return self.index.doc_id(row)
+
+
+class DocumentStoreWriter:
+    # Appends documents chunk by chunk; only the offsets and the ids (as
+    # compact byte-string arrays) stay in memory until close().
+    def __init__(self, path: str):
+        self.path = path
+        self.staging = staging_directory(path)
+        self.texts = open(self.staging / "texts.bin", 'wb')
+        self.offsets = array('q', [0])
+        self.id_chunks = []
+        self.digest = hashlib.sha1()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def add(self, doc_ids: List[str], texts: List[str]):
+        encoded_ids = [doc_id.encode('utf-8') for doc_id in doc_ids]
+        for doc_id, text in zip(encoded_ids, texts):
+            data = text.encode('utf-8')
+            self.texts.write(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+            self.digest.update(doc_id)
+            self.digest.update(b'\n')
+        if encoded_ids:
+            self.id_chunks.append(np.array(encoded_ids, dtype=f"S{max(map(len, encoded_ids))}"))
+
+    def close(self, key: Optional[str] = None) -> DocumentStore:
+        self.texts.close()
+        # Fixed-width byte strings keep the id arrays memory-mappable.
+        width = max((chunk.dtype.itemsize for chunk in self.id_chunks), default=1)
+        ids = np.concatenate([chunk.astype(f"S{width}") for chunk in self.id_chunks]) if self.id_chunks \
+            else np.zeros(0, dtype=f"S{width}")
+        order = np.argsort(ids, kind='stable')
+        np.save(self.staging / "offsets.npy", np.frombuffer(self.offsets, dtype=np.int64))
+        np.save(self.staging / "doc_ids.npy", ids)
+        np.save(self.staging / "sorted_ids.npy", ids[order])
+        np.save(self.staging / "sorted_rows.npy", order.astype(np.int64))
+        write_meta(self.staging, {
+            "format": STORE_FORMAT,
+            "key": key,
+            "num_docs": len(ids),
+            "fingerprint": self.digest.hexdigest()
+        })
+        publish_directory(self.staging, self.path)
+        return DocumentStore(self.path)
+
+
+def build_document_store(path: str, docs: Iterable[Tuple[str, str]], key: Optional[str] = None,
+                         chunk_size: int = 65536) -> DocumentStore:
+    writer = DocumentStoreWriter(path)
+    for doc_ids, texts in iter_chunks(docs, chunk_size):
+        writer.add(doc_ids, texts)
+    return writer.close(key)
+
+
+def load_document_store(path: str, key: Optional[str] = None) -> Optional[DocumentStore]:
+    meta = read_meta(path)
+    if meta is None or meta.get("format") != STORE_FORMAT:
+        return None
+    if key is not None and meta.get("key") != key:
+        return None
+    return DocumentStore(path)
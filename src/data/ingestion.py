@@ -0,0 +1,34 @@
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from tqdm import tqdm
+
+
+# A consumer receives each chunk as parallel lists of doc ids and texts.
+ChunkConsumer = Callable[[List[str], List[str]], None]
+
+
+def iter_chunks(docs: Iterable[Tuple[str, str]], chunk_size: int) -> Iterator[Tuple[List[str], List[str]]]:
+    doc_ids, texts = [], []
+    for doc_id, text in docs:
+        doc_ids.append(doc_id)
+        texts.append(text)
+        if len(doc_ids) == chunk_size:
+            yield doc_ids, texts
+            doc_ids, texts = [], []
+    if doc_ids:
+        yield doc_ids, texts
+
+
+def ingest(docs: Iterable[Tuple[str, str]], consumers: Sequence[ChunkConsumer], chunk_size: int = 65536,
+           total: Optional[int] = None) -> int:
+    # One pass over the collection: every consumer sees a chunk before the
+    # next one is read, so at most one chunk of text is held at a time.
+    num_docs = 0
+    progress = tqdm(total=total, desc="Ingesting documents", unit="doc")
+    for doc_ids, texts in iter_chunks(docs, chunk_size):
+        for consumer in consumers:
+            consumer(doc_ids, texts)
+        num_docs += len(doc_ids)
+        progress.update(len(doc_ids))
+    progress.close()
+    return num_docs
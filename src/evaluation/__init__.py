@@ -1,4 +1,5 @@
 from .metrics import calculate_recall, calculate_ndcg, calculate_precision
+from .run_files import read_run, run_path, write_run
 
-__all__ = ['calculate_recall', 'calculate_ndcg', 'calculate_precision']
+__all__ = ['calculate_recall', 'calculate_ndcg', 'calculate_precision', 'read_run', 'run_path', 'write_run']
 
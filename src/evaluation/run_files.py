@@ -0,0 +1,45 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..retrieval.storage import cache_key, slugify
+
+
+def run_path(data_dir: str, kind: str, dataset_name: str, num_docs: int, **config) -> Path:
+    # One file per retriever (or reranker) configuration; the key covers
+    # every setting that changes the ranking.
+    key = cache_key(kind=kind, dataset=dataset_name, num_docs=num_docs, **config)
+    return Path(data_dir) / "runs" / f"{slugify(dataset_name)}-{num_docs}" / f"{slugify(kind)}-{key[:16]}.run"
+
+
+def write_run(path, rankings: Dict[str, List[Tuple[str, float]]], tag: str = "run", config: Optional[Dict] = None):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for query_id, ranking in rankings.items():
+            for rank, (doc_id, score) in enumerate(ranking, 1):
+                f.write(f"{query_id} Q0 {doc_id} {rank} {float(score)!r} {tag}\n")
+    os.replace(tmp_path, path)
+
+    if config is not None:
+        with open(path.with_suffix(".json"), 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, sort_keys=True, default=str)
+
+
+def read_run(path) -> Dict[str, List[Tuple[str, float]]]:
+    ranked = {}
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 6:
+                raise ValueError(f"{path}:{line_number}: expected 6 fields in a TREC run line, got {len(fields)}")
+            query_id, _, doc_id, rank, score, _ = fields
+            ranked.setdefault(query_id, []).append((int(rank), doc_id, float(score)))
+    return {
+        query_id: [(doc_id, score) for _, doc_id, score in sorted(entries, key=lambda entry: entry[0])]
+        for query_id, entries in ranked.items()
+    }
@@ -1,5 +1,6 @@
 # Reranking module
-from .online_relevance_estimation import OnlineRelevanceEstimation
-
-__all__ = ['OnlineRelevanceEstimation']
+from .online_relevance_estimation import OnlineRelevanceEstimation, rerank_many
+from .cross_encoder_reranker import CrossEncoderReranker
+from .dense_blend_reranker import DenseBlendReranker
 
+__all__ = ['OnlineRelevanceEstimation', 'rerank_many', 'CrossEncoderReranker', 'DenseBlendReranker']
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    def __init__(
+        self,
+        documents: List[str],
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        batch_size: int = 32,
+        num_threads: Optional[int] = None,
+        cache_size: int = 1_000_000,
+        max_length: Optional[int] = None,
+        device: Optional[str] = None
+    ):
+        self.documents = documents
+        self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.batch_size = batch_size
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        # Scores by (query, doc_idx), least recently used first. The lock lets
+        # ORE call the reranker from several threads at once.
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, query: str, doc_indices: List[int]) -> Dict[int, float]:
+        scores = self.score_pairs([(query, doc_idx) for doc_idx in doc_indices])
+        return dict(zip(doc_indices, scores.tolist()))
+
+    def score_batches(self, requests: Sequence[Tuple[str, List[int]]]) -> List[Dict[int, float]]:
+        # Batches of several queries go to the model as one call.
+        pairs = [(query, doc_idx) for query, doc_indices in requests for doc_idx in doc_indices]
+        scores = self.score_pairs(pairs).tolist()
+        results = []
+        start = 0
+        for _, doc_indices in requests:
+            results.append(dict(zip(doc_indices, scores[start:start + len(doc_indices)])))
+            start += len(doc_indices)
+        return results
+
+    def score_pairs(self, pairs: Sequence[Tuple[str, int]]) -> np.ndarray:
+        scores = np.empty(len(pairs), dtype=np.float32)
+        missing = {}
+        with self._lock:
+            for i, pair in enumerate(pairs):
+                if pair in self.cache:
+                    self.cache.move_to_end(pair)
+                    scores[i] = self.cache[pair]
+                    self.hits += 1
+                else:
+                    missing.setdefault(pair, []).append(i)
+            self.misses += len(missing)
+
+        if missing:
+            new_pairs = list(missing)
+            new_scores = self._predict([(query, self.documents[doc_idx]) for query, doc_idx in new_pairs])
+            with self._lock:
+                for pair, score in zip(new_pairs, new_scores.tolist()):
+                    scores[missing[pair]] = score
+                    self.cache[pair] = score
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        return scores
+
+    def _predict(self, texts: List[Tuple[str, str]]) -> np.ndarray:
+        # Sorting by length buckets similar pairs into the same padded batch.
+        order = np.argsort([len(query) + len(doc) for query, doc in texts], kind='stable')
+        with torch.inference_mode():
+            sorted_scores = self.model.predict(
+                [texts[i] for i in order],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+        scores = np.empty(len(texts), dtype=np.float32)
+        scores[order] = np.asarray(sorted_scores, dtype=np.float32).reshape(len(texts))
+        return scores
@@ -0,0 +1,76 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# A document's current score picks its band; higher bands trust it more.
+BLEND_THRESHOLDS = (0.3, 0.6, 0.85)
+CURRENT_WEIGHTS = (0.2, 0.4, 0.6, 0.85)
+DENSE_WEIGHTS = (0.8, 0.6, 0.4, 0.15)
+
+
+class DenseBlendReranker:
+    # The caller passes the current scores of each request's documents (ORE
+    # hands over its own get_scores), so requests never share state.
+    uses_current_scores = True
+
+    def __init__(self, dense_retriever):
+        self.dense_retriever = dense_retriever
+        self.query_embedding_cache = {}
+
+    def __call__(self, query: str, doc_indices: List[int],
+                 current_scores: Optional[Callable[[List[int]], np.ndarray]] = None) -> Dict[int, float]:
+        return self.score_batches([(query, doc_indices)], [current_scores])[0]
+
+    def _query_embeddings(self, queries: List[str]) -> np.ndarray:
+        missing = [query for query in dict.fromkeys(queries) if query not in self.query_embedding_cache]
+        if missing:
+            embeddings = self.dense_retriever.encode_queries(missing)
+            self.query_embedding_cache.update(zip(missing, embeddings))
+        return np.stack([self.query_embedding_cache[query] for query in queries])
+
+    def score_batches(
+        self,
+        requests: Sequence[Tuple[str, List[int]]],
+        current_scores: Optional[Sequence[Optional[Callable[[List[int]], np.ndarray]]]] = None
+    ) -> List[Dict[int, float]]:
+        # All pairs of all requests are scored together; min-max normalization
+        # of the dense scores stays per request.
+        if current_scores is None:
+            current_scores = [None] * len(requests)
+        active = [(query, list(doc_indices), scores_fn)
+                  for (query, doc_indices), scores_fn in zip(requests, current_scores) if len(doc_indices)]
+        if not active:
+            return [{} for _ in requests]
+
+        lengths = np.array([len(doc_indices) for _, doc_indices, _ in active])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        doc_indices = np.concatenate([doc_indices for _, doc_indices, _ in active]).astype(np.int64)
+
+        query_vectors = np.repeat(self._query_embeddings([query for query, _, _ in active]), lengths, axis=0)
+        rows = self.dense_retriever.doc_embeddings[doc_indices]
+        dense = np.einsum('ij,ij->i', rows, query_vectors) / (
+            np.linalg.norm(rows, axis=1) * np.linalg.norm(query_vectors, axis=1)
+        )
+
+        dense_min = np.repeat(np.minimum.reduceat(dense, starts), lengths)
+        dense_max = np.repeat(np.maximum.reduceat(dense, starts), lengths)
+        dense_range = np.where(dense_max > dense_min, dense_max - dense_min, 1.0)
+        norm_dense = (dense - dense_min) / dense_range
+
+        current = np.concatenate([
+            np.zeros(len(batch), dtype=np.float32) if scores_fn is None
+            else np.asarray(scores_fn(batch), dtype=np.float32)
+            for _, batch, scores_fn in active
+        ])
+
+        bands = [current < threshold for threshold in BLEND_THRESHOLDS]
+        new_scores = (np.select(bands, CURRENT_WEIGHTS[:-1], CURRENT_WEIGHTS[-1]) * current
+                      + np.select(bands, DENSE_WEIGHTS[:-1], DENSE_WEIGHTS[-1]) * norm_dense)
+        new_scores = np.maximum(new_scores, current).tolist()
+
+        results = iter([
+            dict(zip(batch, new_scores[start:start + len(batch)]))
+            for (_, batch, _), start in zip(active, starts.tolist())
+        ])
+        return [next(results) if len(batch) else {} for _, batch in requests]
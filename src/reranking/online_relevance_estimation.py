@@ -1,120 +1,419 @@
-from typing import List, Dict, Tuple, Callable, Optional
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Callable, Optional, Set, Union
 import numpy as np
 
 
+UCB_TOLERANCE = 1e-5
+
+
+def _top_slots(values: np.ndarray, k: int) -> np.ndarray:
+    # Indices of the k largest values, ordered like a stable descending sort.
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(values):
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
 class OnlineRelevanceEstimation:
     def __init__(
         self,
         documents: List[str],
-        initial_scores: Dict[int, float],
+        initial_scores: Union[np.ndarray, Dict[int, float]],
         rerank_model: Optional[Callable] = None,
         batch_size: int = 10,
-        exploration_factor: float = 0.1
+        exploration_factor: float = 0.1,
+        corpus_size: Optional[int] = None,
+        tail_score: float = 0.0,
+        max_in_flight: int = 1,
+        sync: bool = False
     ):
         self.documents = documents
-        self.current_scores = initial_scores.copy()
         self.rerank_model = rerank_model
         self.batch_size = batch_size
         self.exploration_factor = exploration_factor
-        self.reranked_docs = set()
         self.rerank_history = []
-    
-    def select_batch(self, query: str) -> List[int]:
-        ucb_scores = {}
-        
-        max_score = max(self.current_scores.values()) if self.current_scores.values() else 1.0
-        min_score = min(self.current_scores.values()) if self.current_scores.values() else 0.0
+
+        # With max_in_flight > 1 (and not sync), up to that many reranker calls
+        # run concurrently while the next batches are chosen from the scores
+        # known so far. The lock keeps a model that reads scores consistent.
+        self.max_in_flight = max_in_flight
+        self.sync = sync
+        self._lock = threading.Lock()
+
+        # Score of a document = base score, plus the accumulated propagation
+        # offset if it has not been reranked yet.
+        self.offset = 0.0
+
+        # With a corpus size, only the candidates in initial_scores are stored and
+        # every other document shares tail_score. The lowest-numbered tail
+        # documents are materialized on demand so that selection and the final
+        # ranking behave exactly as if the whole corpus had been passed in.
+        self.corpus_size = corpus_size
+        self.tail_score = tail_score
+        self._tail = np.zeros(0, dtype=np.int64)
+
+        if isinstance(initial_scores, dict):
+            doc_indices = np.fromiter(initial_scores.keys(), dtype=np.int64, count=len(initial_scores))
+            base_scores = np.fromiter(initial_scores.values(), dtype=np.float32, count=len(initial_scores))
+            if corpus_size is not None:
+                order = np.argsort(doc_indices, kind='stable')
+                doc_indices, base_scores = doc_indices[order], base_scores[order]
+            self._set_slots(doc_indices, base_scores, np.zeros(len(base_scores), dtype=bool))
+            self._fill_tail()
+        elif corpus_size is not None:
+            raise ValueError("corpus_size requires initial_scores for the candidates as a dict")
+        else:
+            self.doc_indices = None
+            self._slot_of = None
+            self._set_slots(None, np.array(initial_scores, dtype=np.float32),
+                            np.zeros(len(initial_scores), dtype=bool))
+
+    def _set_slots(self, doc_indices: Optional[np.ndarray], base_scores: np.ndarray, reranked: np.ndarray):
+        if doc_indices is not None:
+            self.doc_indices = doc_indices
+            self._slot_of = {doc_idx: slot for slot, doc_idx in enumerate(doc_indices.tolist())}
+        self.base_scores = base_scores
+        self.reranked = reranked
+
+        # Propagation shifts every non-reranked score by the same amount, so their
+        # relative order never changes: a lazily extended prefix of that order plus
+        # the (small) reranked set is enough to find each batch.
+        self._reranked_slots = np.flatnonzero(reranked)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._order_complete = False
+        self._head = 0
+        self._min_slot = None
+
+    def _unmaterialized(self, count: int) -> np.ndarray:
+        candidates = np.arange(min(self.corpus_size, len(self.doc_indices) + count), dtype=np.int64)
+        return np.setdiff1d(candidates, self.doc_indices, assume_unique=True)[:count]
+
+    def _fill_tail(self):
+        # Keep more unreranked tail documents than one batch can consume, so the
+        # tail is always represented in selection and in the score range.
+        if self.corpus_size is None:
+            return
+        pending = (~self.reranked[np.searchsorted(self.doc_indices, self._tail)]).sum()
+        reserve = self.batch_size * max(self.max_in_flight, 1)
+        if pending > reserve:
+            return
+        new_ids = self._unmaterialized(max(len(self._tail), reserve + 1))
+        if not len(new_ids):
+            return
+
+        doc_indices = np.concatenate([self.doc_indices, new_ids])
+        order = np.argsort(doc_indices, kind='stable')
+        base_scores = np.concatenate([self.base_scores, np.full(len(new_ids), self.tail_score, dtype=np.float32)])
+        reranked = np.concatenate([self.reranked, np.zeros(len(new_ids), dtype=bool)])
+        self._tail = np.concatenate([self._tail, new_ids])
+        self._set_slots(doc_indices[order], base_scores[order], reranked[order])
+
+    def _tail_value(self) -> np.float32:
+        return np.float32(float(np.float32(self.tail_score)) + self.offset)
+
+    def _slots(self, doc_indices: List[int]) -> np.ndarray:
+        if self._slot_of is None:
+            return np.asarray(doc_indices, dtype=np.int64)
+        return np.fromiter((self._slot_of[idx] for idx in doc_indices), dtype=np.int64, count=len(doc_indices))
+
+    def _doc_ids(self, slots: np.ndarray) -> np.ndarray:
+        return slots if self.doc_indices is None else self.doc_indices[slots]
+
+    def _scores(self, slots) -> np.ndarray:
+        scores = self.base_scores[slots].astype(np.float64)
+        scores[~self.reranked[slots]] += self.offset
+        return scores.astype(np.float32)
+
+    @property
+    def current_scores(self) -> np.ndarray:
+        return self._scores(slice(None))
+
+    def get_scores(self, doc_indices: List[int]) -> np.ndarray:
+        with self._lock:
+            if self._slot_of is None:
+                return self._scores(np.asarray(doc_indices, dtype=np.int64))
+            known = [idx for idx in doc_indices if idx in self._slot_of]
+            scores = dict(zip(known, self._scores(self._slots(known)).tolist()))
+            default = 0.0 if self.corpus_size is None else float(self._tail_value())
+            return np.array([scores.get(idx, default) for idx in doc_indices], dtype=np.float32)
+
+    def _ucb(self, slots, min_score, score_range) -> np.ndarray:
+        normalized_scores = (self._scores(slots) - min_score) / score_range
+        uncertainty = np.where(self.reranked[slots], 0.0, self.exploration_factor * (1.0 - normalized_scores))
+        return normalized_scores + uncertainty
+
+    def _extend_order(self):
+        size = max(2 * len(self._order), 4 * self.batch_size, 1024)
+        unranked = np.where(self.reranked, -np.inf, self.base_scores)
+        remaining = len(unranked) - len(self._reranked_slots)
+        self._order = _top_slots(unranked, min(size, remaining))
+        self._order_complete = size >= remaining
+        self._head = 0
+
+    def _first_unranked(self) -> Optional[int]:
+        while True:
+            while self._head < len(self._order) and self.reranked[self._order[self._head]]:
+                self._head += 1
+            if self._head < len(self._order):
+                return int(self._order[self._head])
+            if self._order_complete:
+                return None
+            self._extend_order()
+
+    def _last_unranked(self) -> Optional[int]:
+        if self._min_slot is None or self.reranked[self._min_slot]:
+            if len(self._reranked_slots) == len(self.base_scores):
+                return None
+            self._min_slot = int(np.argmin(np.where(self.reranked, np.inf, self.base_scores)))
+        return self._min_slot
+
+    def select_batch(self, query: str, exclude: Optional[Set[int]] = None) -> List[int]:
+        if len(self.base_scores) == 0:
+            return []
+
+        # In-flight documents are skipped, so select enough to fill a batch without them.
+        exclude = exclude or set()
+        count = self.batch_size + len(exclude)
+
+        if self.exploration_factor >= 1:
+            scores = self.current_scores
+            max_score = scores.max()
+            min_score = scores.min()
+            score_range = max_score - min_score if max_score > min_score else 1.0
+            ucb_scores = self._ucb(slice(None), min_score, score_range)
+            return self._without(self._doc_ids(_top_slots(ucb_scores, count)), exclude)
+
+        first, last = self._first_unranked(), self._last_unranked()
+        bounds = self._scores(self._reranked_slots)
+        if first is not None:
+            bounds = np.concatenate([bounds, self._scores([first, last])])
+        max_score = bounds.max()
+        min_score = bounds.min()
         score_range = max_score - min_score if max_score > min_score else 1.0
-        
-        for doc_idx in self.current_scores.keys():
-            score = self.current_scores[doc_idx]
-            normalized_score = (score - min_score) / score_range if score_range > 0 else score
-            
-            if doc_idx in self.reranked_docs:
-                uncertainty = 0.0
-            else:
-                uncertainty = self.exploration_factor * (1.0 - normalized_score)
-            
-            ucb_scores[doc_idx] = normalized_score + uncertainty
-        
-        sorted_docs = sorted(
-            ucb_scores.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )
-        
-        return [doc_idx for doc_idx, _ in sorted_docs[:self.batch_size]]
-    
+
+        # Below the batch size, UCB grows with the score for documents that were
+        # not reranked yet, so walk their order until it drops under the current
+        # k-th best (with a margin for float32 rounding).
+        pool_slots = [self._reranked_slots]
+        pool_ucb = [self._ucb(self._reranked_slots, min_score, score_range)]
+        pool_size = len(self._reranked_slots)
+        kth = -np.inf
+        position = self._head
+        while first is not None:
+            if position >= len(self._order):
+                if self._order_complete:
+                    break
+                self._extend_order()
+                return self.select_batch(query, exclude)
+            chunk = self._order[position:position + count]
+            chunk = chunk[~self.reranked[chunk]]
+            position += count
+            if not len(chunk):
+                continue
+            chunk_ucb = self._ucb(chunk, min_score, score_range)
+            if pool_size >= count and chunk_ucb.max() < kth - UCB_TOLERANCE:
+                break
+            pool_slots.append(chunk)
+            pool_ucb.append(chunk_ucb)
+            pool_size += len(chunk)
+            if pool_size >= count:
+                ucb_so_far = np.concatenate(pool_ucb)
+                kth = np.partition(ucb_so_far, len(ucb_so_far) - count)[len(ucb_so_far) - count]
+
+        slots = np.concatenate(pool_slots)
+        ucb_scores = np.concatenate(pool_ucb)
+        selected = slots[np.lexsort((slots, -ucb_scores))[:count]]
+        return self._without(self._doc_ids(selected), exclude)
+
+    def _without(self, doc_ids: np.ndarray, exclude: Set[int]) -> List[int]:
+        return [doc_idx for doc_idx in doc_ids.tolist() if doc_idx not in exclude][:self.batch_size]
+
     def update_scores(self, doc_indices: List[int], new_scores: Dict[int, float]):
-        old_scores_before_update = {}
-        for doc_idx in doc_indices:
-            if doc_idx in new_scores:
-                old_scores_before_update[doc_idx] = self.current_scores.get(doc_idx, 0.0)
-                self.current_scores[doc_idx] = new_scores[doc_idx]
-                self.reranked_docs.add(doc_idx)
-        
-        self._propagate_scores(doc_indices, new_scores, old_scores_before_update)
-    
-    def _propagate_scores(self, reranked_indices: List[int], new_scores: Dict[int, float], old_scores: Dict[int, float]):
-        positive_improvements = []
-        for doc_idx in reranked_indices:
-            if doc_idx in new_scores and doc_idx in old_scores:
-                improvement = new_scores[doc_idx] - old_scores[doc_idx]
-                if improvement > 0:
-                    positive_improvements.append(improvement)
-        
-        if positive_improvements:
-            avg_improvement = np.mean(positive_improvements)
-            for doc_idx in self.current_scores.keys():
-                if doc_idx not in self.reranked_docs:
-                    self.current_scores[doc_idx] += avg_improvement * 0.03
-    
-    def rerank(self, query: str, budget: int = 100, verbose: bool = False) -> List[Tuple[int, float]]:
+        with self._lock:
+            updated = [doc_idx for doc_idx in doc_indices
+                       if doc_idx in new_scores and (self._slot_of is None or doc_idx in self._slot_of)]
+            slots = self._slots(updated)
+
+            old_scores = self._scores(slots)
+            self.base_scores[slots] = np.array([new_scores[doc_idx] for doc_idx in updated], dtype=np.float32)
+            self._reranked_slots = np.union1d(self._reranked_slots, slots)
+            self.reranked[slots] = True
+
+            self._propagate_scores(self.base_scores[slots], old_scores)
+            self._fill_tail()
+
+    def _propagate_scores(self, new_scores: np.ndarray, old_scores: np.ndarray):
+        improvements = new_scores - old_scores
+        positive_improvements = improvements[improvements > 0]
+
+        if len(positive_improvements):
+            avg_improvement = np.mean(positive_improvements, dtype=np.float64)
+            self.offset += float(avg_improvement) * 0.03
+
+    def ranking(self, depth: Optional[int] = None) -> List[Tuple[int, float]]:
+        scores = self.current_scores
+        if self.corpus_size is None:
+            order = np.argsort(-scores, kind='stable') if depth is None else _top_slots(scores, depth)
+            return list(zip(self._doc_ids(order).tolist(), scores[order].tolist()))
+
+        doc_ids = self.doc_indices
+        if depth is not None:
+            top = _top_slots(scores, depth)
+            doc_ids, scores = doc_ids[top], scores[top]
+        tail_ids = self._unmaterialized(self.corpus_size if depth is None else depth)
+        doc_ids = np.concatenate([doc_ids, tail_ids])
+        scores = np.concatenate([scores, np.full(len(tail_ids), self._tail_value(), dtype=np.float32)])
+        order = np.lexsort((doc_ids, -scores))[:depth]
+        return list(zip(doc_ids[order].tolist(), scores[order].tolist()))
+
+    def _score_batch(self, query: str, batch: List[int]) -> Dict[int, float]:
+        if self.rerank_model:
+            if getattr(self.rerank_model, "uses_current_scores", False):
+                return self.rerank_model(query, batch, current_scores=self.get_scores)
+            return self.rerank_model(query, batch)
+        return dict(zip(batch, self.get_scores(batch).tolist()))
+
+    def _report_progress(self, iterations: int, batch_len: int, total_reranked: int, budget: int, verbose: bool):
+        if verbose or iterations % 5 == 0:
+            print(f"    Iteration {iterations}: Re-ranked {batch_len} docs "
+                  f"(Total: {total_reranked}/{budget})", end='\r')
+            sys.stdout.flush()
+
+    def _rerank_sequential(self, query: str, budget: int, verbose: bool) -> Tuple[int, int]:
         iterations = 0
         total_reranked = 0
-        
-        if verbose:
-            print(f"Starting ORE with budget: {budget}")
-        
+
         while total_reranked < budget:
             batch = self.select_batch(query)
             remaining_budget = budget - total_reranked
-            
+
             if remaining_budget <= 0 or not batch:
                 break
-            
+
             actual_batch_size = min(len(batch), remaining_budget)
             batch = batch[:actual_batch_size]
-            
-            if self.rerank_model:
-                new_scores = self.rerank_model(query, batch)
-            else:
-                new_scores = {idx: self.current_scores[idx] for idx in batch}
-            
+
+            new_scores = self._score_batch(query, batch)
             self.update_scores(batch, new_scores)
-            
+
             total_reranked += len(batch)
             iterations += 1
-            
-            if verbose or iterations % 5 == 0:
-                import sys
-                print(f"    Iteration {iterations}: Re-ranked {len(batch)} docs "
-                      f"(Total: {total_reranked}/{budget})", end='\r')
-                sys.stdout.flush()
-        
-        final_ranking = sorted(
-            self.current_scores.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )
-        
+            self._report_progress(iterations, len(batch), total_reranked, budget, verbose)
+
+        return total_reranked, iterations
+
+    def _rerank_pipelined(self, query: str, budget: int, verbose: bool) -> Tuple[int, int]:
+        # Batches are chosen speculatively from the scores known when they are
+        # submitted and applied in submission order as their results arrive.
+        iterations = 0
+        total_reranked = 0
+        submitted = 0
+        in_flight = deque()
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while True:
+                while len(in_flight) < self.max_in_flight and submitted < budget:
+                    batch = self.select_batch(query, exclude=pending)[:budget - submitted]
+                    if not batch:
+                        break
+                    in_flight.append((batch, executor.submit(self._score_batch, query, batch)))
+                    pending.update(batch)
+                    submitted += len(batch)
+
+                if not in_flight:
+                    break
+
+                batch, future = in_flight.popleft()
+                new_scores = future.result()
+                pending.difference_update(batch)
+                self.update_scores(batch, new_scores)
+
+                total_reranked += len(batch)
+                iterations += 1
+                self._report_progress(iterations, len(batch), total_reranked, budget, verbose)
+
+        return total_reranked, iterations
+
+    def rerank(self, query: str, budget: int = 100, verbose: bool = False,
+               depth: Optional[int] = None) -> List[Tuple[int, float]]:
+        if verbose:
+            print(f"Starting ORE with budget: {budget}")
+
+        if self.sync or self.max_in_flight <= 1:
+            total_reranked, iterations = self._rerank_sequential(query, budget, verbose)
+        else:
+            total_reranked, iterations = self._rerank_pipelined(query, budget, verbose)
+
+        final_ranking = self.ranking(depth)
+
         if verbose or iterations > 0:
-            import sys
             print(f"\n    ORE completed: {total_reranked} documents re-ranked in {iterations} iterations")
             sys.stdout.flush()
-        
+
         return final_ranking
-    
+
     def get_document(self, index: int) -> str:
         return self.documents[index]
 
+
+def rerank_many(
+    ores: List[OnlineRelevanceEstimation],
+    queries: List[str],
+    budget: int = 100,
+    depth: Optional[int] = None,
+    verbose: bool = False
+) -> List[List[Tuple[int, float]]]:
+    # Queries advance in lockstep rounds. When they share a rerank model that
+    # can score several queries' batches at once (score_batches), each round
+    # is a single model call; otherwise (or when pipelining) every query runs
+    # on its own.
+    model = ores[0].rerank_model if ores else None
+    if (not hasattr(model, "score_batches") or any(ore.rerank_model is not model for ore in ores)
+            or any(ore.max_in_flight > 1 and not ore.sync for ore in ores)):
+        return [ore.rerank(query, budget=budget, verbose=verbose, depth=depth) for ore, query in zip(ores, queries)]
+
+    totals = [0] * len(ores)
+    active = list(range(len(ores)))
+    rounds = 0
+
+    while active:
+        requests = []
+        for i in active:
+            batch = ores[i].select_batch(queries[i])[:budget - totals[i]]
+            if batch:
+                requests.append((i, batch))
+        if not requests:
+            break
+
+        batch_requests = [(queries[i], batch) for i, batch in requests]
+        if getattr(model, "uses_current_scores", False):
+            new_scores = model.score_batches(batch_requests, [ores[i].get_scores for i, _ in requests])
+        else:
+            new_scores = model.score_batches(batch_requests)
+        for (i, batch), scores in zip(requests, new_scores):
+            ores[i].update_scores(batch, scores)
+            totals[i] += len(batch)
+
+        active = [i for i, _ in requests if totals[i] < budget]
+        rounds += 1
+
+        if verbose or rounds % 5 == 0:
+            print(f"    Round {rounds}: Re-ranked {sum(len(batch) for _, batch in requests)} docs "
+                  f"for {len(requests)} queries (Total: {sum(totals)}/{budget * len(ores)})", end='\r')
+            sys.stdout.flush()
+
+    print(f"\n    ORE completed: {sum(totals)} documents re-ranked for {len(ores)} queries in {rounds} rounds")
+    sys.stdout.flush()
+
+    return [ore.ranking(depth) for ore in ores]
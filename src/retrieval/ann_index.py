@@ -0,0 +1,192 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_matrix import BLOCK_SIZE, EmbeddingMatrix, top_k_indices
+from .storage import publish_directory, read_meta, staging_directory, write_meta
+
+
+ANN_ARRAYS = ("centroids", "list_offsets", "list_ids", "codebooks", "codes")
+# Distance entries per assignment block (64 MB of float32), and the most
+# vectors k-means trains on whatever nlist is.
+ASSIGN_BLOCK_ENTRIES = 1 << 24
+MAX_TRAINING_SAMPLE = 1 << 18
+
+
+def _nearest_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # Row blocks keep the data x centroids distance matrix bounded for large nlist.
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(data), dtype=np.int64)
+    rows = max(1, ASSIGN_BLOCK_ENTRIES // max(len(centroids), 1))
+    for start in range(0, len(data), rows):
+        distances = data[start:start + rows] @ centroids.T
+        distances *= -2
+        distances += centroid_norms
+        assignments[start:start + rows] = np.argmin(distances, axis=1)
+    return assignments
+
+
+def kmeans(data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=len(data) < n_clusters)].copy()
+
+    for _ in range(n_iter):
+        assignments = _nearest_centroids(data, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(data[order], starts, axis=0) / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+
+    return centroids
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = 16,
+        codebooks: Optional[np.ndarray] = None,
+        codes: Optional[np.ndarray] = None,
+        refine_factor: int = 4
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+        self.codebooks = codebooks
+        self.codes = codes
+        self.refine_factor = refine_factor
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def kind(self) -> str:
+        return "ivf" if self.codes is None else "ivfpq"
+
+    def _probe(self, lists: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        starts, ends = self.list_offsets[lists], self.list_offsets[lists + 1]
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(lists) else np.zeros(0, dtype=np.int64)
+        return positions, np.repeat(lists, ends - starts)
+
+    def search(self, matrix: EmbeddingMatrix, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        centroid_scores = queries @ self.centroids.T
+        probes = top_k_indices(centroid_scores, self.nprobe)
+        results = []
+
+        for query, probe, scores_by_list in zip(queries, probes, centroid_scores):
+            positions, lists = self._probe(probe)
+            ids = np.asarray(self.list_ids[positions], dtype=np.int64)
+
+            if self.codes is not None:
+                m, _, sub_dim = self.codebooks.shape
+                lut = np.einsum('msd,md->ms', self.codebooks, query.reshape(m, sub_dim))
+                approx = scores_by_list[lists] + lut[np.arange(m), self.codes[positions]].sum(axis=1)
+                if not self.refine_factor:
+                    top = top_k_indices(approx, k)
+                    results.append((ids[top], approx[top]))
+                    continue
+                ids = ids[top_k_indices(approx, k * self.refine_factor)]
+
+            ids = np.sort(ids)
+            scores = matrix[ids] @ query
+            top = top_k_indices(scores, k)
+            results.append((ids[top], scores[top]))
+
+        return results
+
+    def save(self, path: str, key: str = ""):
+        staging = staging_directory(path)
+        for name in ANN_ARRAYS:
+            value = getattr(self, name)
+            if value is not None:
+                np.save(staging / f"{name}.npy", value)
+        write_meta(staging, {"key": key, "kind": self.kind, "nlist": self.nlist})
+        publish_directory(staging, path)
+
+
+def load_ivf_index(path: str, key: Optional[str] = None, nprobe: int = 16,
+                   refine_factor: int = 4) -> Optional[IVFIndex]:
+    meta = read_meta(path)
+    if meta is None or (key is not None and meta.get("key") != key):
+        return None
+    arrays = {}
+    for name in ANN_ARRAYS:
+        array_path = Path(path) / f"{name}.npy"
+        arrays[name] = np.load(array_path, mmap_mode='r') if array_path.exists() else None
+    arrays["centroids"] = np.asarray(arrays["centroids"])
+    if arrays["codebooks"] is not None:
+        arrays["codebooks"] = np.asarray(arrays["codebooks"])
+    return IVFIndex(nprobe=nprobe, refine_factor=refine_factor, **arrays)
+
+
+def build_ivf_index(
+    matrix: EmbeddingMatrix,
+    nlist: int,
+    nprobe: int = 16,
+    pq_m: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    n_iter: int = 20,
+    seed: int = 0,
+    refine_factor: int = 4
+) -> IVFIndex:
+    num_docs, dim = matrix.shape
+    if pq_m is not None and dim % pq_m != 0:
+        raise ValueError(f"Embedding dimension {dim} is not divisible by pq_m={pq_m}")
+
+    rng = np.random.default_rng(seed)
+    sample_size = min(num_docs, sample_size or min(max(nlist * 64, 65536), MAX_TRAINING_SAMPLE))
+    sample = matrix[np.sort(rng.choice(num_docs, sample_size, replace=False))]
+    centroids = kmeans(sample, nlist, n_iter=n_iter, seed=seed)
+
+    codebooks = None
+    if pq_m is not None:
+        residuals = sample - centroids[_nearest_centroids(sample, centroids)]
+        sub_dim = dim // pq_m
+        codebooks = np.stack([
+            kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], 256, n_iter=n_iter, seed=seed + j)
+            for j in range(pq_m)
+        ])
+
+    assignments = np.empty(num_docs, dtype=np.int64)
+    codes = np.empty((num_docs, pq_m), dtype=np.uint8) if pq_m is not None else None
+    for start, block in matrix.blocks(BLOCK_SIZE):
+        block_assignments = _nearest_centroids(block, centroids)
+        assignments[start:start + len(block)] = block_assignments
+        if codes is not None:
+            residuals = block - centroids[block_assignments]
+            for j, codebook in enumerate(codebooks):
+                codes[start:start + len(block), j] = _nearest_centroids(
+                    residuals[:, j * sub_dim:(j + 1) * sub_dim], codebook
+                )
+
+    order = np.argsort(assignments, kind='stable')
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+
+    return IVFIndex(
+        centroids=centroids,
+        list_offsets=list_offsets,
+        list_ids=order.astype(np.int32),
+        nprobe=nprobe,
+        codebooks=codebooks,
+        codes=codes[order] if codes is not None else None,
+        refine_factor=refine_factor
+    )
+
+
+def recall_at_k(exact: List[np.ndarray], approximate: List[np.ndarray], k: int) -> float:
+    recalls = [
+        len(np.intersect1d(e[:k], a[:k])) / max(min(k, len(e)), 1)
+        for e, a in zip(exact, approximate)
+    ]
+    return float(np.mean(recalls)) if recalls else 0.0
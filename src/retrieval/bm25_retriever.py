@@ -1,25 +1,77 @@
 from rank_bm25 import BM25Okapi
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from .inverted_index import TOKENIZER, build_index_parallel, load_index, tokenize
+from .storage import cache_key
+
+
+def index_key(dataset_name: Optional[str], num_docs: int, fingerprint: Optional[str]) -> str:
+    return cache_key(dataset=dataset_name, num_docs=num_docs, tokenizer=TOKENIZER, fingerprint=fingerprint)
 
 
 class BM25Retriever:
-    def __init__(self, documents: List[str]):
-        tokenized_docs = [doc.lower().split() for doc in documents]
-        self.bm25 = BM25Okapi(tokenized_docs)
+    def __init__(
+        self,
+        documents: List[str],
+        backend: str = "index",
+        pruning: bool = True,
+        index_dir: Optional[str] = None,
+        dataset_name: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        workers: int = 1
+    ):
+        if backend not in ("index", "rank_bm25"):
+            raise ValueError(f"Unknown BM25 backend: {backend}")
+        self.backend = backend
+        self.pruning = pruning
         self.documents = documents
-        
-    def retrieve(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
-        tokenized_query = query.lower().split()
+        self.bm25 = None
+        self.index = None
+
+        if backend == "rank_bm25":
+            tokenized_docs = [tokenize(doc) for doc in documents]
+            self.bm25 = BM25Okapi(tokenized_docs)
+            return
+
+        key = index_key(dataset_name, len(documents), fingerprint)
+        if index_dir is not None:
+            self.index = load_index(index_dir, key)
+            if self.index is not None:
+                print(f"Loaded BM25 index from {index_dir}")
+                return
+
+        self.index = build_index_parallel(documents, workers)
+        if index_dir is not None:
+            self.index.save(index_dir, key)
+            print(f"Saved BM25 index to {index_dir}")
+
+    def retrieve(self, query: str, top_k: int = 10, pruning: Optional[bool] = None) -> List[Tuple[int, float]]:
+        tokenized_query = tokenize(query)
+
+        if self.index is not None:
+            if pruning is None:
+                pruning = self.pruning
+            indices, scores = self.index.top_k(tokenized_query, top_k, pruning=pruning)
+            return list(zip(indices.tolist(), scores.tolist()))
+
         scores = self.bm25.get_scores(tokenized_query)
-        
+
         top_indices = sorted(
-            range(len(scores)), 
-            key=lambda i: scores[i], 
+            range(len(scores)),
+            key=lambda i: scores[i],
             reverse=True
         )[:top_k]
-        
+
         return [(idx, scores[idx]) for idx in top_indices]
-    
+
+    def max_score(self, query: str) -> Optional[float]:
+        if self.index is None:
+            return None
+        terms = [self.index.vocab[token] for token in tokenize(query) if token in self.index.vocab]
+        return float(self.index.max_scores[terms].sum()) if terms else 0.0
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 10,
+                       pruning: Optional[bool] = None) -> List[List[Tuple[int, float]]]:
+        return [self.retrieve(query, top_k=top_k, pruning=pruning) for query in queries]
+
     def get_document(self, index: int) -> str:
         return self.documents[index]
-
@@ -1,34 +1,211 @@
 from sentence_transformers import SentenceTransformer
+import inspect
 import numpy as np
-from typing import List, Tuple
+import os
+import sys
+from tqdm import tqdm
+from typing import Dict, List, Optional, Sequence, Tuple
+from .ann_index import build_ivf_index, load_ivf_index, recall_at_k
+from .embedding_cache import EmbeddingCache
+from .embedding_matrix import build_embedding_matrix
+from .storage import cache_key
+
+
+def embedding_dimension(model: SentenceTransformer) -> int:
+    if hasattr(model, "get_embedding_dimension"):
+        return model.get_embedding_dimension()
+    return model.get_sentence_embedding_dimension()
+
+
+ENCODE_THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def start_encode_pool(model: SentenceTransformer, workers: int) -> Optional[Dict]:
+    if workers <= 1:
+        return None
+    # Spawned workers read the thread limits when they import torch; without
+    # them every worker would use all cores.
+    saved = {name: os.environ.get(name) for name in ENCODE_THREAD_VARIABLES}
+    os.environ.update({name: str(max(1, (os.cpu_count() or 1) // workers)) for name in ENCODE_THREAD_VARIABLES})
+    try:
+        return model.start_multi_process_pool(target_devices=["cpu"] * workers)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def stop_encode_pool(model: SentenceTransformer, pool: Optional[Dict]):
+    if pool is not None:
+        model.stop_multi_process_pool(pool)
+
+
+def encode_documents(model: SentenceTransformer, texts: Sequence[str], batch_size: int = 32,
+                     pool: Optional[Dict] = None) -> np.ndarray:
+    if not len(texts):
+        return np.zeros((0, embedding_dimension(model)), dtype=np.float32)
+
+    # encode() only length-sorts within one call; sorting the whole chunk first
+    # also gives every pool process a run of similar lengths to pad together.
+    order = np.argsort([-len(text) for text in texts], kind='stable')
+    sorted_texts = [texts[i] for i in order]
+    if pool is None:
+        sorted_embeddings = model.encode(sorted_texts, batch_size=batch_size, show_progress_bar=False,
+                                         convert_to_numpy=True)
+    elif "pool" in inspect.signature(model.encode).parameters:
+        sorted_embeddings = model.encode(sorted_texts, pool=pool, batch_size=batch_size, show_progress_bar=False,
+                                         convert_to_numpy=True)
+    else:
+        sorted_embeddings = model.encode_multi_process(sorted_texts, pool, batch_size=batch_size)
+
+    embeddings = np.empty((len(texts), sorted_embeddings.shape[1]), dtype=np.float32)
+    embeddings[order] = sorted_embeddings
+    return embeddings
+
+
+def embedding_key(model_name: str, dataset_name: Optional[str], num_docs: int, fingerprint: Optional[str]) -> str:
+    return cache_key(model=model_name, dataset=dataset_name, num_docs=num_docs, fingerprint=fingerprint)
+
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
 
 
 class DenseRetriever:
-    def __init__(self, documents: List[str], model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        documents: List[str],
+        model_name: str = DEFAULT_MODEL,
+        cache_dir: Optional[str] = None,
+        dataset_name: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        chunk_size: int = 65536,
+        normalize: bool = False,
+        precision: str = "float32",
+        ann: Optional[str] = None,
+        nlist: Optional[int] = None,
+        nprobe: int = 16,
+        pq_m: int = 16,
+        batch_size: int = 32,
+        encode_workers: int = 1
+    ):
         self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
         self.documents = documents
-        print(f"Encoding {len(documents):,} documents...")
-        import sys
+        self.batch_size = batch_size
+        self.encode_workers = encode_workers
+        cache = None
+
+        if cache_dir is not None:
+            key = embedding_key(model_name, dataset_name, len(documents), fingerprint)
+            cache = EmbeddingCache(cache_dir, key, len(documents))
+            self.doc_embeddings = cache.load_matrix(normalize, precision)
+            if self.doc_embeddings is None:
+                embeddings = self._encode_cached(cache, chunk_size)
+                self.doc_embeddings = build_embedding_matrix(embeddings, normalize, precision)
+                if normalize or precision != "float32":
+                    cache.save_matrix(self.doc_embeddings)
+        else:
+            print(f"Encoding {len(documents):,} documents...")
+            sys.stdout.flush()
+            pool = start_encode_pool(self.model, encode_workers)
+            try:
+                embeddings = encode_documents(self.model, documents, batch_size=batch_size, pool=pool)
+            finally:
+                stop_encode_pool(self.model, pool)
+            self.doc_embeddings = build_embedding_matrix(embeddings, normalize, precision)
+            print("Encoding complete!")
+            sys.stdout.flush()
+
+        self.ann_index = None
+        if ann is not None:
+            self.ann_index = self._load_or_build_ann(ann, nlist, nprobe, pq_m, cache)
+
+    def _load_or_build_ann(self, ann: str, nlist: Optional[int], nprobe: int, pq_m: int,
+                           cache: Optional[EmbeddingCache]):
+        if ann not in ("ivf", "ivfpq"):
+            raise ValueError(f"Unknown ANN index: {ann}")
+        if not self.doc_embeddings.normalized:
+            raise ValueError("Approximate search requires normalize=True")
+
+        nlist = nlist or max(1, int(4 * np.sqrt(len(self.documents))))
+        pq_m = pq_m if ann == "ivfpq" else None
+        index_path = None
+        if cache is not None:
+            index_path = cache.path / f"ann-{ann}-{nlist}-{pq_m or 0}-{self.doc_embeddings.precision}"
+            ann_index = load_ivf_index(index_path, cache.key, nprobe=nprobe)
+            if ann_index is not None:
+                print(f"Loaded {ann.upper()} index from {index_path}")
+                return ann_index
+
+        print(f"Training {ann.upper()} index with {nlist:,} lists...")
         sys.stdout.flush()
-        self.doc_embeddings = self.model.encode(
-            documents, 
-            show_progress_bar=True,
-            convert_to_numpy=True,
-            batch_size=32
-        )
+        ann_index = build_ivf_index(self.doc_embeddings, nlist, nprobe=nprobe, pq_m=pq_m)
+        if index_path is not None:
+            ann_index.save(index_path, cache.key)
+        return ann_index
+
+    def _encode_cached(self, cache: EmbeddingCache, chunk_size: int) -> np.ndarray:
+        if cache.is_complete:
+            print(f"Loaded document embeddings from {cache.path}")
+            return cache.load()
+
+        start = cache.completed
+        if start:
+            print(f"Resuming encoding at document {start:,} of {len(self.documents):,}...")
+        else:
+            print(f"Encoding {len(self.documents):,} documents...")
+        sys.stdout.flush()
+
+        embeddings = cache.open_for_write(embedding_dimension(self.model))
+        progress = tqdm(total=len(self.documents), initial=start, desc="Encoding documents", unit="doc")
+        pool = start_encode_pool(self.model, self.encode_workers)
+        try:
+            for chunk_start in range(start, len(self.documents), chunk_size):
+                chunk_end = min(chunk_start + chunk_size, len(self.documents))
+                embeddings[chunk_start:chunk_end] = encode_documents(
+                    self.model,
+                    self.documents[chunk_start:chunk_end],
+                    batch_size=self.batch_size,
+                    pool=pool
+                )
+                embeddings.flush()
+                cache.mark_completed(chunk_end)
+                progress.update(chunk_end - chunk_start)
+        finally:
+            stop_encode_pool(self.model, pool)
+        progress.close()
+        del embeddings
+
         print("Encoding complete!")
         sys.stdout.flush()
+        return cache.load()
     
     def retrieve(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
-        query_embedding = self.model.encode(query, convert_to_numpy=True)
+        return self.retrieve_batch([query], top_k=top_k)[0]
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 10,
+                       batch_size: int = 32) -> List[List[Tuple[int, float]]]:
+        query_embeddings = self.encode_queries(queries, batch_size=batch_size)
         
-        similarities = np.dot(self.doc_embeddings, query_embedding) / (
-            np.linalg.norm(self.doc_embeddings, axis=1) * np.linalg.norm(query_embedding)
-        )
+        if self.ann_index is not None:
+            query_embeddings = query_embeddings / np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+            results = self.ann_index.search(self.doc_embeddings, query_embeddings, top_k)
+        else:
+            results = zip(*self.doc_embeddings.search(query_embeddings, top_k))
         
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        return [(int(idx), float(similarities[idx])) for idx in top_indices]
+        return [list(zip(indices.tolist(), scores.tolist())) for indices, scores in results]
+    
+    def encode_queries(self, queries: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(queries, convert_to_numpy=True, batch_size=batch_size, show_progress_bar=False)
+    
+    def ann_recall(self, queries: List[str], k: int = 100) -> float:
+        query_embeddings = self.encode_queries(queries)
+        query_embeddings = query_embeddings / np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+        exact = list(self.doc_embeddings.search(query_embeddings, k)[0])
+        approximate = [indices for indices, _ in self.ann_index.search(self.doc_embeddings, query_embeddings, k)]
+        return recall_at_k(exact, approximate, k)
     
     def get_document(self, index: int) -> str:
         return self.documents[index]
-
@@ -0,0 +1,133 @@
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from numpy.lib import format as npy_format
+from numpy.lib.format import open_memmap
+
+from .embedding_matrix import EmbeddingMatrix, load_embedding_matrix
+from .storage import publish_directory, read_meta, write_meta
+
+
+def _matrix_name(normalize: bool, precision: str) -> str:
+    return f"matrix-{precision}-{'normalized' if normalize else 'raw'}"
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, key: str, num_docs: int):
+        self.path = Path(path)
+        self.key = key
+        self.num_docs = num_docs
+        self.embeddings_path = self.path / "embeddings.npy"
+
+        meta = read_meta(self.path)
+        if meta is None or meta.get("key") != key or not self.embeddings_path.exists():
+            meta = None
+        self.meta = meta
+
+    @property
+    def completed(self) -> int:
+        return self.meta["completed"] if self.meta is not None else 0
+
+    @property
+    def is_complete(self) -> bool:
+        return self.meta is not None and self.completed >= self.num_docs
+
+    def load(self) -> np.ndarray:
+        return np.load(self.embeddings_path, mmap_mode='r')
+
+    def open_for_write(self, dim: int) -> np.memmap:
+        if self.meta is not None and self.meta["dim"] == dim:
+            return open_memmap(self.embeddings_path, mode='r+')
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        for stale in self.path.glob("matrix-*"):
+            stale.unlink()
+        for stale in self.path.glob("ann-*"):
+            shutil.rmtree(stale)
+        self.meta = {"key": self.key, "num_docs": self.num_docs, "dim": dim, "completed": 0}
+        write_meta(self.path, self.meta)
+        return open_memmap(self.embeddings_path, mode='w+', dtype=np.float32, shape=(self.num_docs, dim))
+
+    def mark_completed(self, rows: int):
+        self.meta["completed"] = rows
+        write_meta(self.path, self.meta)
+
+    def load_matrix(self, normalize: bool, precision: str) -> Optional[EmbeddingMatrix]:
+        if not self.is_complete:
+            return None
+        return load_embedding_matrix(self.path, _matrix_name(normalize, precision), normalized=normalize)
+
+    def save_matrix(self, matrix: EmbeddingMatrix):
+        matrix.save(self.path, _matrix_name(matrix.normalized, matrix.precision))
+
+
+def _resize_rows(path: Path, rows: int):
+    # numpy pads .npy headers so the first axis can change in place; the
+    # header keeps its length and the data is truncated or extended.
+    with open(path, 'r+b') as f:
+        version = npy_format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+        header_len = f.tell()
+        f.seek(0)
+        header = {"descr": npy_format.dtype_to_descr(dtype), "fortran_order": fortran_order,
+                  "shape": (rows,) + tuple(shape[1:])}
+        if version == (1, 0):
+            npy_format.write_array_header_1_0(f, header)
+        else:
+            npy_format.write_array_header_2_0(f, header)
+        if f.tell() != header_len:
+            raise ValueError(f"Cannot resize {path} in place")
+        f.truncate(header_len + rows * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+
+
+class EmbeddingWriter:
+    # Appends embeddings chunk by chunk while the corpus size, and so the
+    # cache path and key, are still unknown. The file grows as needed and
+    # close() publishes it as a complete cache. With a key, the rows written
+    # so far are recorded in the staging meta after every chunk, and a writer
+    # reopened with the same key continues after them.
+    def __init__(self, staging: str, dim: int, capacity: int = 0, key: Optional[str] = None):
+        self.staging = Path(staging)
+        self.dim = dim
+        self.key = key
+        self.embeddings_path = self.staging / "embeddings.npy"
+
+        meta = read_meta(self.staging)
+        if (key is not None and meta is not None and meta.get("key") == key and meta.get("dim") == dim
+                and self.embeddings_path.exists()):
+            self.rows = meta["completed"]
+            self.embeddings = open_memmap(self.embeddings_path, mode='r+')
+            return
+
+        if self.staging.exists():
+            shutil.rmtree(self.staging)
+        self.staging.mkdir(parents=True)
+        self.rows = 0
+        self.embeddings = open_memmap(self.embeddings_path, mode='w+', dtype=np.float32, shape=(capacity, dim))
+
+    def append(self, embeddings: np.ndarray):
+        end = self.rows + len(embeddings)
+        if end > len(self.embeddings):
+            capacity = max(end, 2 * len(self.embeddings), 65536)
+            self.embeddings.flush()
+            del self.embeddings
+            _resize_rows(self.embeddings_path, capacity)
+            self.embeddings = open_memmap(self.embeddings_path, mode='r+')
+        self.embeddings[self.rows:end] = embeddings
+        self.rows = end
+        if self.key is not None:
+            self.embeddings.flush()
+            write_meta(self.staging, {"key": self.key, "dim": self.dim, "completed": self.rows})
+
+    def close(self, path: str, key: str) -> EmbeddingCache:
+        self.embeddings.flush()
+        del self.embeddings
+        _resize_rows(self.embeddings_path, self.rows)
+        write_meta(self.staging, {"key": key, "num_docs": self.rows, "dim": self.dim, "completed": self.rows})
+        publish_directory(self.staging, path)
+        return EmbeddingCache(path, key, self.rows)
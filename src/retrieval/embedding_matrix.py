@@ -0,0 +1,140 @@
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+PRECISIONS = ("float32", "float16", "int8")
+BLOCK_SIZE = 1 << 16
+
+
+class EmbeddingMatrix:
+    def __init__(self, data: np.ndarray, normalized: bool = False, scales: Optional[np.ndarray] = None):
+        self.data = data
+        self.normalized = normalized
+        self.scales = scales
+        self.precision = str(data.dtype)
+        self._norms = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __getitem__(self, index) -> np.ndarray:
+        rows = np.asarray(self.data[index], dtype=np.float32)
+        if self.scales is not None:
+            rows = rows * self.scales
+        return rows
+
+    def blocks(self, block_size: int = BLOCK_SIZE):
+        for start in range(0, len(self.data), block_size):
+            yield start, self[start:start + block_size]
+
+    def norms(self) -> np.ndarray:
+        if self.normalized:
+            return np.ones(len(self.data), dtype=np.float32)
+        if self._norms is None:
+            self._norms = np.empty(len(self.data), dtype=np.float32)
+            for start, block in self.blocks():
+                self._norms[start:start + len(block)] = np.linalg.norm(block, axis=1)
+        return self._norms
+
+    def search(self, vectors: np.ndarray, k: int, block_size: int = BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        # One matrix-matrix product per block for all queries, keeping a running
+        # per-row top-k, so the corpus is read once however many queries there are.
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        query_norms = np.linalg.norm(vectors, axis=1)
+        scaled = vectors * self.scales if self.scales is not None else vectors
+        doc_norms = None if self.normalized else self.norms()
+
+        best_ids = np.zeros((len(vectors), 0), dtype=np.int64)
+        best_scores = np.zeros((len(vectors), 0), dtype=np.float32)
+        for start in range(0, len(self.data), block_size):
+            block = self.data[start:start + block_size]
+            scores = (scaled @ block.astype(np.float32, copy=False).T) / query_norms[:, None]
+            if doc_norms is not None:
+                scores /= doc_norms[start:start + len(block)]
+            local = top_k_indices(scores, k)
+            candidate_ids = np.concatenate([best_ids, local + start], axis=1)
+            candidate_scores = np.concatenate([best_scores, np.take_along_axis(scores, local, axis=1)], axis=1)
+            keep = top_k_indices(candidate_scores, k)
+            best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+            best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+
+        return best_ids, best_scores
+
+    def save(self, path: str, name: str):
+        # The data file is published last, so a matrix whose data file exists
+        # is complete.
+        if self.scales is not None:
+            _save_atomic(Path(path) / f"{name}.scales.npy", self.scales)
+        _save_atomic(Path(path) / f"{name}.npy", self.data)
+
+
+def _save_atomic(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_embedding_matrix(path: str, name: str, normalized: bool) -> Optional[EmbeddingMatrix]:
+    data_path = Path(path) / f"{name}.npy"
+    if not data_path.exists():
+        return None
+    scales_path = Path(path) / f"{name}.scales.npy"
+    try:
+        data = np.load(data_path, mmap_mode='r')
+        scales = np.load(scales_path) if scales_path.exists() else None
+    except ValueError:
+        # Truncated by an interrupted save from an older version; rebuilt by the caller.
+        return None
+    if data.dtype == np.int8 and scales is None:
+        return None
+    return EmbeddingMatrix(data, normalized=normalized, scales=scales)
+
+
+def build_embedding_matrix(embeddings: np.ndarray, normalize: bool = False, precision: str = "float32",
+                           block_size: int = BLOCK_SIZE) -> EmbeddingMatrix:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown embedding precision: {precision}")
+    if not normalize and precision == "float32":
+        return EmbeddingMatrix(embeddings)
+
+    def rows(start):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        if normalize:
+            block = block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+        return block
+
+    scales = None
+    if precision == "int8":
+        max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+        for start in range(0, len(embeddings), block_size):
+            np.maximum(max_abs, np.abs(rows(start)).max(axis=0), out=max_abs)
+        scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+    data = np.empty(embeddings.shape, dtype=precision)
+    for start in range(0, len(embeddings), block_size):
+        block = rows(start)
+        if scales is not None:
+            block = np.clip(np.rint(block / scales), -127, 127)
+        data[start:start + len(block)] = block
+
+    return EmbeddingMatrix(data, normalized=normalize, scales=scales)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1)
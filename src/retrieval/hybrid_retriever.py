@@ -1,56 +1,114 @@
-from typing import List, Tuple
+import numpy as np
+from typing import Dict, List, Optional, Tuple
 from .bm25_retriever import BM25Retriever
 from .dense_retriever import DenseRetriever
+from .embedding_matrix import top_k_indices
+
+
+FUSION_MODES = ("minmax", "zscore", "rrf", "convex")
+DENSE_SCORE_BOUNDS = (-1.0, 1.0)
+
+
+def _as_arrays(results: List[Tuple[int, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    indices, scores = zip(*results)
+    return np.asarray(indices, dtype=np.int64), np.asarray(scores, dtype=np.float64)
+
+
+def _normalize(scores: np.ndarray, fusion: str, bounds: Optional[Tuple[float, float]] = None,
+               rrf_k: int = 60) -> Tuple[np.ndarray, float]:
+    # Returns the normalized scores and the value used for documents missing from the list.
+    if len(scores) == 0:
+        return scores, 0.0
+    if fusion == "minmax":
+        low, high = scores.min(), scores.max()
+        return ((scores - low) / (high - low) if high > low else scores), 0.0
+    if fusion == "zscore":
+        std = scores.std()
+        normalized = (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+        return normalized, float(normalized.min())
+    if fusion == "rrf":
+        return 1.0 / (rrf_k + np.arange(1, len(scores) + 1)), 0.0
+    low, high = bounds
+    return (scores - low) / (high - low) if high > low else scores - low, 0.0
 
 
 class HybridRetriever:
-    def __init__(self, documents: List[str], alpha: float = 0.5):
+    def __init__(
+        self,
+        documents: List[str],
+        alpha: float = 0.5,
+        bm25_retriever: Optional[BM25Retriever] = None,
+        dense_retriever: Optional[DenseRetriever] = None,
+        fusion: str = "minmax",
+        rrf_k: int = 60,
+        score_bounds: Optional[Dict[str, Tuple[float, float]]] = None
+    ):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode: {fusion}")
+        for component in (bm25_retriever, dense_retriever):
+            if component is not None and len(component.documents) != len(documents):
+                raise ValueError(
+                    f"{type(component).__name__} was built over {len(component.documents):,} documents, "
+                    f"expected {len(documents):,}"
+                )
         self.alpha = alpha
-        self.bm25_retriever = BM25Retriever(documents)
-        self.dense_retriever = DenseRetriever(documents)
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.score_bounds = score_bounds or {}
+        self.bm25_retriever = bm25_retriever if bm25_retriever is not None else BM25Retriever(documents)
+        self.dense_retriever = dense_retriever if dense_retriever is not None else DenseRetriever(documents)
         self.documents = documents
     
-    def retrieve(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
-        bm25_results = self.bm25_retriever.retrieve(query, top_k=top_k * 2)
-        dense_results = self.dense_retriever.retrieve(query, top_k=top_k * 2)
-        
-        bm25_scores = {idx: score for idx, score in bm25_results}
-        dense_scores = {idx: score for idx, score in dense_results}
-        
-        if bm25_scores:
-            max_bm25 = max(bm25_scores.values())
-            min_bm25 = min(bm25_scores.values())
-            if max_bm25 > min_bm25:
-                bm25_scores = {
-                    idx: (score - min_bm25) / (max_bm25 - min_bm25)
-                    for idx, score in bm25_scores.items()
-                }
+    def retrieve(self, query: str, top_k: int = 10, fusion: Optional[str] = None) -> List[Tuple[int, float]]:
+        return self.retrieve_batch([query], top_k=top_k, fusion=fusion)[0]
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 10,
+                       fusion: Optional[str] = None) -> List[List[Tuple[int, float]]]:
+        bm25_batch, dense_batch = self.retrieve_components(queries, top_k=top_k * 2)
+        return [
+            self.fuse(bm25_results, dense_results, top_k, fusion=fusion, query=query)
+            for query, bm25_results, dense_results in zip(queries, bm25_batch, dense_batch)
+        ]
+    
+    def retrieve_components(self, queries: List[str], top_k: int = 20):
+        return (
+            self.bm25_retriever.retrieve_batch(queries, top_k=top_k),
+            self.dense_retriever.retrieve_batch(queries, top_k=top_k)
+        )
+    
+    def fuse(self, bm25_results: List[Tuple[int, float]], dense_results: List[Tuple[int, float]],
+             top_k: int = 10, fusion: Optional[str] = None, query: Optional[str] = None) -> List[Tuple[int, float]]:
+        fusion = fusion or self.fusion
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode: {fusion}")
         
-        if dense_scores:
-            max_dense = max(dense_scores.values())
-            min_dense = min(dense_scores.values())
-            if max_dense > min_dense:
-                dense_scores = {
-                    idx: (score - min_dense) / (max_dense - min_dense)
-                    for idx, score in dense_scores.items()
-                }
+        bm25_indices, bm25_scores = _as_arrays(bm25_results)
+        dense_indices, dense_scores = _as_arrays(dense_results)
         
-        combined_scores = {}
-        all_indices = set(bm25_scores.keys()) | set(dense_scores.keys())
+        bm25_bounds = dense_bounds = None
+        if fusion == "convex":
+            bm25_bounds = self.score_bounds.get("bm25")
+            if bm25_bounds is None:
+                upper = self.bm25_retriever.max_score(query) if query is not None else None
+                if upper is None:
+                    upper = float(bm25_scores.max()) if len(bm25_scores) else 1.0
+                bm25_bounds = (0.0, upper)
+            dense_bounds = self.score_bounds.get("dense", DENSE_SCORE_BOUNDS)
         
-        for idx in all_indices:
-            bm25_score = bm25_scores.get(idx, 0.0)
-            dense_score = dense_scores.get(idx, 0.0)
-            combined_scores[idx] = self.alpha * bm25_score + (1 - self.alpha) * dense_score
+        bm25_norm, bm25_missing = _normalize(bm25_scores, fusion, bm25_bounds, self.rrf_k)
+        dense_norm, dense_missing = _normalize(dense_scores, fusion, dense_bounds, self.rrf_k)
         
-        sorted_results = sorted(
-            combined_scores.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:top_k]
+        all_indices = np.union1d(bm25_indices, dense_indices)
+        bm25_combined = np.full(len(all_indices), bm25_missing)
+        bm25_combined[np.searchsorted(all_indices, bm25_indices)] = bm25_norm
+        dense_combined = np.full(len(all_indices), dense_missing)
+        dense_combined[np.searchsorted(all_indices, dense_indices)] = dense_norm
         
-        return sorted_results
+        combined_scores = self.alpha * bm25_combined + (1 - self.alpha) * dense_combined
+        top = top_k_indices(combined_scores, top_k)
+        return list(zip(all_indices[top].tolist(), combined_scores[top].tolist()))
     
     def get_document(self, index: int) -> str:
         return self.documents[index]
-
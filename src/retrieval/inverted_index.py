@@ -0,0 +1,387 @@
+import math
+import multiprocessing
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .storage import publish_directory, read_meta, staging_directory, write_meta
+
+
+PRUNING_SLACK = 1e-9
+TOKENIZER = "lower-whitespace"
+INDEX_ARRAYS = ("doc_lens", "offsets", "postings_docs", "postings_tfs", "idf", "max_scores")
+
+
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+
+class InvertedIndex:
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        doc_lens: np.ndarray,
+        offsets: np.ndarray,
+        postings_docs: np.ndarray,
+        postings_tfs: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        idf: Optional[np.ndarray] = None,
+        max_scores: Optional[np.ndarray] = None
+    ):
+        self.vocab = vocab
+        self.doc_lens = doc_lens
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.num_docs = len(doc_lens)
+        self.avgdl = int(doc_lens.sum(dtype=np.int64)) / self.num_docs if self.num_docs else 0.0
+        self.doc_freqs = np.diff(offsets)
+        self.idf = self._calc_idf(self.doc_freqs) if idf is None else idf
+        self._norm = self.k1 * (1 - self.b + self.b * doc_lens / self.avgdl) if self.num_docs else np.zeros(0)
+        self.max_scores = self._calc_max_scores() if max_scores is None else max_scores
+
+    def _calc_idf(self, doc_freqs: np.ndarray) -> np.ndarray:
+        # Mirrors BM25Okapi._calc_idf term by term so scores match bit for bit.
+        idf = np.zeros(len(doc_freqs), dtype=np.float64)
+        idf_sum = 0.0
+        negative = []
+        for term, freq in enumerate(doc_freqs.tolist()):
+            value = math.log(self.num_docs - freq + 0.5) - math.log(freq + 0.5)
+            idf[term] = value
+            idf_sum += value
+            if value < 0:
+                negative.append(term)
+        if len(idf):
+            idf[negative] = self.epsilon * (idf_sum / len(idf))
+        return idf
+
+    def _calc_max_scores(self, chunk_size: int = 1 << 24) -> np.ndarray:
+        max_scores = np.zeros(len(self.doc_freqs), dtype=np.float64)
+        start = 0
+        while start < len(max_scores):
+            end = int(np.searchsorted(self.offsets, self.offsets[start] + chunk_size, side='right')) - 1
+            end = min(max(end, start + 1), len(max_scores))
+            lo, hi = self.offsets[start], self.offsets[end]
+            docs = self.postings_docs[lo:hi]
+            tfs = self.postings_tfs[lo:hi].astype(np.float64)
+            idf = np.repeat(self.idf[start:end], self.doc_freqs[start:end])
+            contrib = idf * (tfs * (self.k1 + 1) / (tfs + self._norm[docs]))
+            nonempty = self.doc_freqs[start:end] > 0
+            starts = (self.offsets[start:end] - lo)[nonempty]
+            max_scores[start:end][nonempty] = np.maximum.reduceat(contrib, starts)
+            start = end
+        return max_scores
+
+    def term_scores(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term], self.offsets[term + 1]
+        docs = self.postings_docs[start:end]
+        tfs = self.postings_tfs[start:end].astype(np.float64)
+        return docs, self.idf[term] * (tfs * (self.k1 + 1) / (tfs + self._norm[docs]))
+
+    def lookup(self, term: int, doc_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term], self.offsets[term + 1]
+        docs = self.postings_docs[start:end]
+        if len(docs) == 0 or len(doc_ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if len(doc_ids) <= len(docs):
+            pos = np.minimum(np.searchsorted(docs, doc_ids), len(docs) - 1)
+            hits = np.flatnonzero(docs[pos] == doc_ids)
+            postings = start + pos[hits]
+        else:
+            pos = np.minimum(np.searchsorted(doc_ids, docs), len(doc_ids) - 1)
+            matched = np.flatnonzero(doc_ids[pos] == docs)
+            hits = pos[matched]
+            postings = start + matched
+        tfs = self.postings_tfs[postings].astype(np.float64)
+        return hits, self.idf[term] * (tfs * (self.k1 + 1) / (tfs + self._norm[doc_ids[hits]]))
+
+    def rescore(self, tokens: List[str], doc_ids: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(doc_ids), dtype=np.float64)
+        for token in tokens:
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            hits, contrib = self.lookup(term, doc_ids)
+            scores[hits] += contrib
+        return scores
+
+    def score(self, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        doc_parts, score_parts = [], []
+        for token in tokens:
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            docs, scores = self.term_scores(term)
+            doc_parts.append(docs)
+            score_parts.append(scores)
+
+        if not doc_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        return _accumulate(doc_parts, score_parts)
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        candidates, scores = self.score(tokens)
+        full = np.zeros(self.num_docs, dtype=np.float64)
+        full[candidates] = scores
+        return full
+
+    def top_k(self, tokens: List[str], k: int, pruning: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if pruning:
+            return self.top_k_pruned(tokens, k)
+        candidates, scores = self.score(tokens)
+        return select_top_k(candidates, scores, k, self.num_docs)
+
+    def top_k_pruned(self, tokens: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Term-at-a-time MaxScore: terms are visited by decreasing upper bound and,
+        # once the k-th best partial score beats the bound of every remaining term,
+        # the rest only probe documents already in the accumulator. Survivors are
+        # rescored in query order, so the result equals the exhaustive top-k.
+        terms = [self.vocab[token] for token in tokens if token in self.vocab]
+        if k <= 0 or not terms or np.any(self.idf[terms] < 0):
+            return self.top_k(tokens, k)
+
+        weights = Counter(terms)
+        ordered = sorted(weights, key=lambda t: self.max_scores[t] * weights[t], reverse=True)
+        bounds = np.array([self.max_scores[t] * weights[t] for t in ordered])
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1][1:], 0.0)
+
+        acc_ids = np.zeros(0, dtype=np.int64)
+        acc_scores = np.zeros(0, dtype=np.float64)
+        essential = True
+
+        for i, term in enumerate(ordered):
+            if essential:
+                docs, scores = self.term_scores(term)
+                acc_ids, acc_scores = _accumulate([acc_ids, docs], [acc_scores, scores * weights[term]])
+            else:
+                hits, scores = self.lookup(term, acc_ids)
+                acc_scores[hits] += scores * weights[term]
+
+            if len(acc_ids) < k:
+                continue
+            theta = np.partition(acc_scores, len(acc_scores) - k)[len(acc_scores) - k]
+            if theta <= 0:
+                continue
+            if remaining[i] < theta * (1 - PRUNING_SLACK):
+                essential = False
+            keep = acc_scores + remaining[i] >= theta * (1 - PRUNING_SLACK)
+            acc_ids, acc_scores = acc_ids[keep], acc_scores[keep]
+
+        if len(acc_ids) > k:
+            kth = np.partition(acc_scores, len(acc_scores) - k)[len(acc_scores) - k]
+            if kth > 0:
+                keep = acc_scores >= kth * (1 - PRUNING_SLACK)
+                acc_ids = acc_ids[keep]
+
+        return select_top_k(acc_ids, self.rescore(tokens, acc_ids), k, self.num_docs)
+
+    def save(self, path: str, key: str = ""):
+        staging = staging_directory(path)
+        for name in INDEX_ARRAYS:
+            np.save(staging / f"{name}.npy", getattr(self, name))
+
+        terms = [""] * len(self.vocab)
+        for token, term in self.vocab.items():
+            terms[term] = token
+        with open(staging / "vocab.txt", 'w', encoding='utf-8') as f:
+            f.write("\n".join(terms))
+
+        write_meta(staging, {
+            "key": key,
+            "tokenizer": TOKENIZER,
+            "num_docs": self.num_docs,
+            "num_terms": len(self.vocab),
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon
+        })
+        publish_directory(staging, path)
+
+
+def load_index(path: str, key: Optional[str] = None) -> Optional[InvertedIndex]:
+    meta = read_meta(path)
+    if meta is None or meta.get("tokenizer") != TOKENIZER:
+        return None
+    if key is not None and meta.get("key") != key:
+        return None
+
+    arrays = {name: np.load(Path(path) / f"{name}.npy", mmap_mode='r') for name in INDEX_ARRAYS}
+    with open(Path(path) / "vocab.txt", encoding='utf-8') as f:
+        terms = f.read().split("\n") if meta["num_terms"] else []
+
+    return InvertedIndex(
+        vocab={token: term for term, token in enumerate(terms)},
+        k1=meta["k1"],
+        b=meta["b"],
+        epsilon=meta["epsilon"],
+        **arrays
+    )
+
+
+class InvertedIndexBuilder:
+    # Collects postings chunk by chunk so the index can be built while the
+    # collection streams past, without keeping the tokenized documents.
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.doc_lens = array('i')
+        self.term_ids = array('i')
+        self.doc_ids = array('i')
+        self.tfs = array('i')
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lens)
+
+    def add(self, tokenized_docs: Iterable[List[str]]):
+        vocab = self.vocab
+        for doc_id, tokens in enumerate(tokenized_docs, len(self.doc_lens)):
+            self.doc_lens.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                term = vocab.get(token)
+                if term is None:
+                    term = len(vocab)
+                    vocab[token] = term
+                self.term_ids.append(term)
+                self.doc_ids.append(doc_id)
+                self.tfs.append(tf)
+
+    def merge(self, other: "InvertedIndexBuilder"):
+        # Appends the documents of `other` after this builder's. Its terms are
+        # renumbered in its own first-seen order, so merging shards in order
+        # numbers terms exactly as one builder over all documents would.
+        vocab = self.vocab
+        mapping = np.empty(len(other.vocab), dtype=np.int32)
+        for local, token in enumerate(other.vocab):
+            term = vocab.get(token)
+            if term is None:
+                term = len(vocab)
+                vocab[token] = term
+            mapping[local] = term
+        self.term_ids.frombytes(mapping[np.frombuffer(other.term_ids, dtype=np.int32)].tobytes())
+        self.doc_ids.frombytes((np.frombuffer(other.doc_ids, dtype=np.int32) + self.num_docs).astype(np.int32).tobytes())
+        self.tfs.extend(other.tfs)
+        self.doc_lens.extend(other.doc_lens)
+
+    def build(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> InvertedIndex:
+        term_ids = np.frombuffer(self.term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)), out=offsets[1:])
+
+        return InvertedIndex(
+            vocab=self.vocab,
+            doc_lens=np.frombuffer(self.doc_lens, dtype=np.int32).copy(),
+            offsets=offsets,
+            postings_docs=np.frombuffer(self.doc_ids, dtype=np.int32)[order],
+            postings_tfs=np.frombuffer(self.tfs, dtype=np.int32)[order],
+            k1=k1,
+            b=b,
+            epsilon=epsilon
+        )
+
+
+def build_index(tokenized_docs: Iterable[List[str]], k1: float = 1.5, b: float = 0.75,
+                epsilon: float = 0.25) -> InvertedIndex:
+    builder = InvertedIndexBuilder()
+    builder.add(tokenized_docs)
+    return builder.build(k1=k1, b=b, epsilon=epsilon)
+
+
+# Set by build_index_parallel just before forking; workers slice their shard
+# out of it instead of receiving the texts through pickling.
+_SHARD_DOCUMENTS = None
+
+
+def _build_shard(bounds: Tuple[int, int]) -> InvertedIndexBuilder:
+    start, end = bounds
+    builder = InvertedIndexBuilder()
+    builder.add(tokenize(doc) for doc in _SHARD_DOCUMENTS[start:end])
+    return builder
+
+
+def build_index_parallel(documents: Sequence[str], workers: int, shard_size: Optional[int] = None,
+                         k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> InvertedIndex:
+    global _SHARD_DOCUMENTS
+    # Shard workers fork to inherit the documents; without fork (Windows) the
+    # index is built in this process.
+    if workers <= 1 or len(documents) < 2 or "fork" not in multiprocessing.get_all_start_methods():
+        return build_index((tokenize(doc) for doc in documents), k1=k1, b=b, epsilon=epsilon)
+
+    shard_size = shard_size or min(100_000, -(-len(documents) // (4 * workers)))
+    bounds = [(start, min(start + shard_size, len(documents))) for start in range(0, len(documents), shard_size)]
+    builder = InvertedIndexBuilder()
+    _SHARD_DOCUMENTS = documents
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for shard in pool.imap(_build_shard, bounds):
+                builder.merge(shard)
+    finally:
+        _SHARD_DOCUMENTS = None
+    return builder.build(k1=k1, b=b, epsilon=epsilon)
+
+
+def _accumulate(doc_parts: List[np.ndarray], score_parts: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    # Every part is sorted by doc id, so the stable sort only merges runs, and
+    # bincount adds each document's contributions in the order of the parts.
+    docs = np.concatenate(doc_parts).astype(np.int64, copy=False)
+    if len(docs) == 0:
+        return docs, np.zeros(0, dtype=np.float64)
+    order = np.argsort(docs, kind='stable')
+    docs = docs[order]
+    first = np.empty(len(docs), dtype=bool)
+    first[0] = True
+    np.not_equal(docs[1:], docs[:-1], out=first[1:])
+    inverse = np.cumsum(first) - 1
+    scores = np.bincount(inverse, weights=np.concatenate(score_parts)[order], minlength=int(inverse[-1]) + 1)
+    return docs[first], scores
+
+
+def select_top_k(candidates: np.ndarray, scores: np.ndarray, k: int,
+                 num_docs: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Same order as a stable descending sort over the full score vector:
+    # documents outside `candidates` score 0.0 and ties go to the lower index.
+    k = min(k, num_docs)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    positive = scores > 0
+    pos_ids, pos_scores = candidates[positive], scores[positive]
+
+    if len(pos_ids) > k:
+        kth = np.partition(pos_scores, len(pos_scores) - k)[len(pos_scores) - k]
+        above = pos_scores > kth
+        ties = np.flatnonzero(pos_scores == kth)[:k - int(above.sum())]
+        keep = np.concatenate([np.flatnonzero(above), ties])
+        pos_ids, pos_scores = pos_ids[keep], pos_scores[keep]
+
+    order = np.lexsort((pos_ids, -pos_scores))
+    ids, top_scores = pos_ids[order], pos_scores[order]
+    missing = k - len(ids)
+    if missing == 0:
+        return ids, top_scores
+
+    nonzero = candidates[scores != 0]
+    pool = np.arange(min(missing + len(nonzero), num_docs), dtype=np.int64)
+    zero_ids = pool[~np.isin(pool, nonzero)][:missing]
+    ids = np.concatenate([ids, zero_ids])
+    top_scores = np.concatenate([top_scores, np.zeros(len(zero_ids))])
+    missing -= len(zero_ids)
+
+    if missing > 0:
+        negative = scores < 0
+        neg_ids, neg_scores = candidates[negative], scores[negative]
+        order = np.lexsort((neg_ids, -neg_scores))[:missing]
+        ids = np.concatenate([ids, neg_ids[order]])
+        top_scores = np.concatenate([top_scores, neg_scores[order]])
+
+    return ids, top_scores
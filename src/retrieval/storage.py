@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+
+def cache_key(**parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def corpus_fingerprint(doc_ids: Iterable[str]) -> str:
+    digest = hashlib.sha1()
+    for doc_id in doc_ids:
+        digest.update(doc_id.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def slugify(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+
+
+def index_directory(data_dir: str, kind: str, dataset_name: str, num_docs: int) -> Path:
+    return Path(data_dir) / "indexes" / slugify(kind) / f"{slugify(dataset_name)}-{num_docs}"
+
+
+def read_meta(path) -> Optional[Dict]:
+    meta_path = Path(path) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_meta(path, meta: Dict):
+    meta_path = Path(path) / "meta.json"
+    tmp_path = meta_path.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def staging_directory(path) -> Path:
+    staging = Path(path).with_name(Path(path).name + ".tmp")
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+    return staging
+
+
+def publish_directory(staging, path):
+    path = Path(path)
+    if path.exists():
+        shutil.rmtree(path)
+    Path(staging).rename(path)
@@ -0,0 +1,228 @@
+from experiment import (build_rerank_model, build_retrievers, fork_workers, init_worker_threads, load_corpus,
+                        normalize_initial_scores, run_ore)
+from src.evaluation import calculate_recall, calculate_ndcg, calculate_precision
+from src.retrieval.hybrid_retriever import FUSION_MODES
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+import numpy as np
+from typing import Dict, List, Optional, Set, Tuple
+
+
+SWEEP_PARAMETERS = ("alpha", "budget", "batch_size", "exploration")
+METRICS = ("recall", "ndcg", "precision")
+
+
+def parse_values(text: str, cast) -> List:
+    return [cast(value) for value in text.split(",") if value.strip()]
+
+
+def sweep_configs(values: Dict[str, List], search: str = "grid", trials: int = 20, seed: int = 0) -> List[Dict]:
+    grid = [dict(zip(SWEEP_PARAMETERS, combo)) for combo in itertools.product(*(values[name] for name in SWEEP_PARAMETERS))]
+    if search == "grid":
+        return grid
+    if search == "random":
+        return random.Random(seed).sample(grid, min(trials, len(grid)))
+    raise ValueError(f"Unknown search: {search}")
+
+
+def evaluate_ranking(ranked_docs: List[int], relevant_indices: Set[int], top_k: int) -> Tuple[float, float, float]:
+    return (
+        calculate_recall(ranked_docs, relevant_indices, k=top_k),
+        calculate_ndcg(ranked_docs, relevant_indices, k=top_k),
+        calculate_precision(ranked_docs, relevant_indices, k=top_k)
+    )
+
+
+def prepare_queries(retriever, loader, doc_index, queries, bm25_batch, dense_batch, alpha: float,
+                    retrieval_depth: int, top_k: int):
+    # Fusion is cheap, so each alpha re-fuses the same component results.
+    retriever.alpha = alpha
+    prepared = []
+    for (query_id, query_text), bm25_results, dense_results in zip(queries, bm25_batch, dense_batch):
+        relevant_indices = {doc_index[doc_id] for doc_id in loader.get_relevant_docs(query_id) if doc_id in doc_index}
+        if not relevant_indices:
+            continue
+        initial_results = retriever.fuse(bm25_results, dense_results, retrieval_depth, query=query_text)
+        baseline = evaluate_ranking([idx for idx, _ in initial_results[:top_k]], relevant_indices, top_k)
+        initial_scores = normalize_initial_scores(initial_results) if baseline[1] < 0.995 else None
+        prepared.append((query_text, relevant_indices, baseline, initial_scores))
+    return prepared
+
+
+# Set by run_sweep just before forking; workers inherit the prepared
+# candidates, indexes and rerank model instead of pickling them.
+_SWEEP_CONTEXT = {}
+
+
+def evaluate_config(config: Dict) -> Dict:
+    context = _SWEEP_CONTEXT
+    prepared = context["prepared"][config["alpha"]]
+    tasks = [(query_text, initial_scores) for query_text, _, _, initial_scores in prepared if initial_scores is not None]
+
+    start = time.time()
+    rankings = iter(run_ore(
+        tasks,
+        documents=context["documents"],
+        rerank_model=context["rerank_model"],
+        budget=config["budget"],
+        top_k=context["top_k"],
+        batch_size=config["batch_size"],
+        exploration_factor=config["exploration"],
+        in_flight=1
+    ))
+
+    baseline, ore = [], []
+    for _, relevant_indices, baseline_metrics, initial_scores in prepared:
+        baseline.append(baseline_metrics)
+        if initial_scores is None:
+            ore.append(baseline_metrics)
+        else:
+            ore.append(evaluate_ranking([idx for idx, _ in next(rankings)], relevant_indices, context["top_k"]))
+
+    row = dict(config)
+    for name, values in (("baseline", baseline), ("ore", ore)):
+        averages = np.mean(values, axis=0) if values else np.zeros(len(METRICS))
+        for metric, value in zip(METRICS, averages):
+            row[f"{name}_{metric}"] = round(float(value), 4)
+    row["queries"] = len(prepared)
+    row["seconds"] = round(time.time() - start, 2)
+    return row
+
+
+def run_sweep(configs: List[Dict], workers: int = 1, num_threads: Optional[int] = None, **context) -> List[Dict]:
+    _SWEEP_CONTEXT.update(context)
+    try:
+        workers = min(fork_workers(workers), len(configs))
+        if workers <= 1:
+            return [evaluate_config(config) for config in configs]
+        num_threads = num_threads or max(1, (os.cpu_count() or 1) // workers)
+        with multiprocessing.get_context("fork").Pool(workers, init_worker_threads, (num_threads,)) as pool:
+            return pool.map(evaluate_config, configs)
+    finally:
+        _SWEEP_CONTEXT.clear()
+
+
+def write_results(rows: List[Dict], path: str):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep ORE hyperparameters over cached first-stage candidates")
+    parser.add_argument("--dataset", type=str, default="msmarco-passage/trec-dl-2019/judged",
+                       help="Dataset name")
+    parser.add_argument("--num-queries", type=int, default=10,
+                       help="Number of queries to evaluate")
+    parser.add_argument("--num-docs", type=int, default=10000,
+                       help="Number of documents to load (0 = all 8.8M documents)")
+    parser.add_argument("--top-k", type=int, default=20,
+                       help="Cutoff for the evaluation metrics")
+    parser.add_argument("--alpha", type=str, default="0.5",
+                       help="Comma-separated hybrid retriever alphas")
+    parser.add_argument("--budget", type=str, default="50",
+                       help="Comma-separated ORE budgets")
+    parser.add_argument("--batch-size", type=str, default="10",
+                       help="Comma-separated ORE batch sizes")
+    parser.add_argument("--exploration", type=str, default="0.2",
+                       help="Comma-separated ORE exploration factors")
+    parser.add_argument("--search", type=str, default="grid", choices=["grid", "random"],
+                       help="Evaluate every combination, or --trials random combinations")
+    parser.add_argument("--trials", type=int, default=20,
+                       help="Number of configurations for --search random")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Seed for --search random")
+    parser.add_argument("--fusion", type=str, default="minmax", choices=list(FUSION_MODES),
+                       help="Hybrid score fusion")
+    parser.add_argument("--reranker", type=str, default="dense", choices=["dense", "cross-encoder"],
+                       help="ORE rerank model")
+    parser.add_argument("--cross-encoder-model", type=str, default="cross-encoder/ms-marco-MiniLM-L-6-v2",
+                       help="Cross-encoder model used with --reranker cross-encoder")
+    parser.add_argument("--reranker-threads", type=int, default=None,
+                       help="Torch CPU threads per process for the cross-encoder")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Processes evaluating configurations in parallel")
+    parser.add_argument("--no-index-cache", action="store_true",
+                       help="Always rebuild indexes and embeddings instead of reusing the copies saved under data/indexes")
+    parser.add_argument("--index-workers", type=int, default=1,
+                       help="Processes that tokenize and build BM25 postings for document shards in parallel")
+    parser.add_argument("--encode-workers", type=int, default=1,
+                       help="Processes encoding documents with the sentence-transformers multi-process pool")
+    parser.add_argument("--encode-batch-size", type=int, default=32,
+                       help="Batch size for encoding documents")
+    parser.add_argument("--document-store", action="store_true",
+                       help="Keep documents in a memory-mapped store under data/indexes/docstore instead of in RAM")
+    parser.add_argument("--output", type=str, default="sweep_results.csv",
+                       help="CSV file for the results table")
+
+    args = parser.parse_args()
+
+    values = {
+        "alpha": parse_values(args.alpha, float),
+        "budget": parse_values(args.budget, int),
+        "batch_size": parse_values(args.batch_size, int),
+        "exploration": parse_values(args.exploration, float)
+    }
+    configs = sweep_configs(values, search=args.search, trials=args.trials, seed=args.seed)
+    print(f"Sweeping {len(configs)} configurations ({args.search} search)")
+
+    loader, documents, doc_index, queries = load_corpus(args.dataset, args.num_docs, args.num_queries,
+                                                        document_store=args.document_store,
+                                                        index_cache=not args.no_index_cache,
+                                                        encode_batch_size=args.encode_batch_size,
+                                                        encode_workers=args.encode_workers)
+    bm25_retriever, dense_retriever, retriever = build_retrievers(
+        documents, doc_index, queries, args.dataset,
+        index_cache=not args.no_index_cache,
+        fusion=args.fusion,
+        index_workers=args.index_workers,
+        encode_batch_size=args.encode_batch_size,
+        encode_workers=args.encode_workers
+    )
+    rerank_model = build_rerank_model(args.reranker, documents, dense_retriever,
+                                      cross_encoder_model=args.cross_encoder_model,
+                                      reranker_threads=args.reranker_threads)
+
+    retrieval_depth = min(len(documents), 10000)
+    print(f"\nRunning first-stage retrieval for {len(queries)} queries (once for all configurations)...")
+    sys.stdout.flush()
+    bm25_batch, dense_batch = retriever.retrieve_components(
+        [query_text for _, query_text in queries], top_k=retrieval_depth * 2
+    )
+    prepared = {
+        alpha: prepare_queries(retriever, loader, doc_index, queries, bm25_batch, dense_batch, alpha,
+                               retrieval_depth, args.top_k)
+        for alpha in values["alpha"]
+    }
+
+    print(f"\nEvaluating {len(configs)} configurations with {args.workers} worker(s)...")
+    sys.stdout.flush()
+    rows = run_sweep(
+        configs,
+        workers=args.workers,
+        num_threads=args.reranker_threads,
+        prepared=prepared,
+        documents=documents,
+        rerank_model=rerank_model,
+        top_k=args.top_k
+    )
+    write_results(rows, args.output)
+
+    print("\n" + "=" * 80)
+    print(f"SWEEP RESULTS (best NDCG@{args.top_k} first, full table in {args.output})")
+    print("=" * 80)
+    print(f"  {'alpha':<7} {'budget':<7} {'batch':<6} {'explore':<8} {'base NDCG':<10} {'ORE NDCG':<9} ORE Recall")
+    for row in sorted(rows, key=lambda row: -row["ore_ndcg"]):
+        print(f"  {row['alpha']:<7} {row['budget']:<7} {row['batch_size']:<6} {row['exploration']:<8} "
+              f"{row['baseline_ndcg']:<10.4f} {row['ore_ndcg']:<9.4f} {row['ore_recall']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
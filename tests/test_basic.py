@@ -1,5 +1,20 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+from experiment import normalize_initial_scores, run_ore_parallel
+from sweep import METRICS, SWEEP_PARAMETERS, evaluate_ranking, run_sweep, sweep_configs
 from src.retrieval import BM25Retriever, DenseRetriever, HybridRetriever
-from src.reranking import OnlineRelevanceEstimation
+from src.reranking import OnlineRelevanceEstimation, CrossEncoderReranker, DenseBlendReranker, rerank_many
+from src.evaluation import read_run, run_path, write_run
+from src.data import DatasetLoader, DocumentStoreWriter, build_document_store, ingest, load_document_store
+from src.retrieval import ann_index
+from src.retrieval.dense_retriever import encode_documents, start_encode_pool, stop_encode_pool
+from src.retrieval.embedding_cache import EmbeddingWriter
+from src.retrieval.inverted_index import INDEX_ARRAYS, InvertedIndexBuilder, build_index, build_index_parallel, tokenize
 
 
 def create_mock_data():
@@ -40,6 +55,50 @@ def test_bm25():
         print(f"  {i}. [Score: {score:.3f}] {documents[doc_idx]}")
 
 
+def test_bm25_index_matches_rank_bm25():
+    documents, queries = create_mock_data()
+    index_retriever = BM25Retriever(documents)
+    reference = BM25Retriever(documents, backend="rank_bm25")
+    
+    for query in queries:
+        expected = reference.retrieve(query, top_k=len(documents))
+        actual = index_retriever.retrieve(query, top_k=len(documents))
+        assert [idx for idx, _ in actual] == [idx for idx, _ in expected]
+        assert [score for _, score in actual] == [float(score) for _, score in expected]
+    
+    print("\nBM25 inverted index matches rank_bm25")
+
+
+def test_bm25_pruning_matches_exhaustive():
+    documents, queries = create_mock_data()
+    retriever = BM25Retriever(documents)
+    
+    for query in queries + ["learning networks neural data"]:
+        for top_k in (1, 3, len(documents)):
+            pruned = retriever.retrieve(query, top_k=top_k, pruning=True)
+            exhaustive = retriever.retrieve(query, top_k=top_k, pruning=False)
+            assert pruned == exhaustive
+    
+    print("BM25 MaxScore pruning matches exhaustive scoring")
+
+
+def test_bm25_index_persistence():
+    documents, queries = create_mock_data()
+    
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+        index_dir = f"{tmp_dir}/bm25"
+        built = BM25Retriever(documents, index_dir=index_dir, dataset_name="mock")
+        loaded = BM25Retriever(documents, index_dir=index_dir, dataset_name="mock")
+        assert loaded.index.postings_docs.filename is not None
+        for query in queries:
+            assert loaded.retrieve(query, top_k=5) == built.retrieve(query, top_k=5)
+        
+        rebuilt = BM25Retriever(documents[:-1], index_dir=index_dir, dataset_name="mock")
+        assert rebuilt.index.num_docs == len(documents) - 1
+    
+    print("BM25 index round-trips through disk")
+
+
 def test_dense():
     documents, queries = create_mock_data()
     retriever = DenseRetriever(documents)
@@ -50,6 +109,61 @@ def test_dense():
         print(f"  {i}. [Score: {score:.3f}] {documents[doc_idx]}")
 
 
+def test_dense_embedding_cache():
+    documents, queries = create_mock_data()
+    
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+        encoded = DenseRetriever(documents, cache_dir=tmp_dir, dataset_name="mock", chunk_size=4)
+        cached = DenseRetriever(documents, cache_dir=tmp_dir, dataset_name="mock", chunk_size=4)
+        assert cached.doc_embeddings.data.filename is not None
+        assert cached.retrieve(queries[0], top_k=5) == encoded.retrieve(queries[0], top_k=5)
+        
+        int8 = DenseRetriever(documents, cache_dir=tmp_dir, dataset_name="mock", normalize=True, precision="int8")
+        matrix_paths = list(Path(tmp_dir).rglob("matrix-int8-normalized.npy"))
+        assert len(matrix_paths) == 1 and not list(Path(tmp_dir).rglob("*.tmp"))
+        with open(matrix_paths[0], 'r+b') as f:
+            f.truncate(64)
+        rebuilt = DenseRetriever(documents, cache_dir=tmp_dir, dataset_name="mock", normalize=True, precision="int8")
+        assert rebuilt.retrieve(queries[0], top_k=5) == int8.retrieve(queries[0], top_k=5)
+    
+    print("Dense embeddings reused from cache")
+
+
+def test_dense_reduced_precision():
+    documents, queries = create_mock_data()
+    exact = DenseRetriever(documents)
+    expected = [idx for idx, _ in exact.retrieve(queries[0], top_k=3)]
+    
+    for precision in ("float32", "float16", "int8"):
+        retriever = DenseRetriever(documents, normalize=True, precision=precision)
+        assert str(retriever.doc_embeddings.data.dtype) == precision
+        assert [idx for idx, _ in retriever.retrieve(queries[0], top_k=3)] == expected
+    
+    print("Normalized float16/int8 embeddings keep the dense top-3")
+
+
+def test_dense_ann():
+    documents, queries = create_mock_data()
+    exhaustive = DenseRetriever(documents, normalize=True, ann="ivf", nlist=3, nprobe=3)
+    assert exhaustive.ann_recall(queries, k=5) == 1.0
+    
+    retriever = DenseRetriever(documents, normalize=True, ann="ivfpq", nlist=3, nprobe=1)
+    results = retriever.retrieve(queries[0], top_k=3)
+    assert len(results) <= 3
+    print(f"IVF-PQ recall@5 with nprobe=1: {retriever.ann_recall(queries, k=5):.2f}")
+    
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((100, 8)).astype(np.float32)
+    centroids = rng.standard_normal((7, 8)).astype(np.float32)
+    expected = np.argmin(((data[:, None, :] - centroids[None]) ** 2).sum(axis=2), axis=1)
+    block_entries = ann_index.ASSIGN_BLOCK_ENTRIES
+    ann_index.ASSIGN_BLOCK_ENTRIES = 20
+    try:
+        assert np.array_equal(ann_index._nearest_centroids(data, centroids), expected)
+    finally:
+        ann_index.ASSIGN_BLOCK_ENTRIES = block_entries
+
+
 def test_hybrid():
     documents, queries = create_mock_data()
     retriever = HybridRetriever(documents, alpha=0.5)
@@ -60,6 +174,58 @@ def test_hybrid():
         print(f"  {i}. [Score: {score:.3f}] {documents[doc_idx]}")
 
 
+def test_hybrid_shares_components():
+    documents, queries = create_mock_data()
+    bm25 = BM25Retriever(documents)
+    dense = DenseRetriever(documents)
+    shared = HybridRetriever(documents, alpha=0.5, bm25_retriever=bm25, dense_retriever=dense)
+    assert shared.bm25_retriever is bm25 and shared.dense_retriever is dense
+    
+    standalone = HybridRetriever(documents, alpha=0.5)
+    assert [i for i, _ in shared.retrieve(queries[1], top_k=5)] == [i for i, _ in standalone.retrieve(queries[1], top_k=5)]
+    
+    print("HybridRetriever reuses pre-built component retrievers")
+
+
+def test_hybrid_fusion_modes():
+    documents, queries = create_mock_data()
+    retriever = HybridRetriever(documents, alpha=0.5)
+    
+    for fusion in ("minmax", "zscore", "rrf", "convex"):
+        results = retriever.retrieve(queries[0], top_k=5, fusion=fusion)
+        scores = [score for _, score in results]
+        assert len(results) == 5 and scores == sorted(scores, reverse=True)
+        print(f"{fusion:>7}: {[idx for idx, _ in results]}")
+    
+    fixed = HybridRetriever(documents, alpha=0.5, bm25_retriever=retriever.bm25_retriever,
+                            dense_retriever=retriever.dense_retriever, score_bounds={"bm25": (0.0, 4.0)})
+    bm25_results = [(0, 4.0), (1, 2.0), (2, 1.0)]
+    dense_results = [(1, 0.8), (3, 0.6), (0, 0.2)]
+    expected = {
+        "rrf": [(1, 0.5 * (1 / 61 + 1 / 62)), (0, 0.5 * (1 / 61 + 1 / 63)), (3, 0.5 / 62), (2, 0.5 / 63)],
+        "convex": [(0, 0.5 * (1.0 + 0.6)), (1, 0.5 * (0.5 + 0.9)), (3, 0.5 * 0.8), (2, 0.5 * 0.25)],
+        "minmax": [(1, 0.5 * (1 / 3 + 1.0)), (0, 0.5 * 1.0), (3, 0.5 * 2 / 3), (2, 0.0)]
+    }
+    for fusion, ranking in expected.items():
+        results = fixed.fuse(bm25_results, dense_results, top_k=4, fusion=fusion)
+        assert [idx for idx, _ in results] == [idx for idx, _ in ranking]
+        assert np.allclose([score for _, score in results], [score for _, score in ranking])
+
+
+def test_retrieve_batch():
+    documents, queries = create_mock_data()
+    hybrid = HybridRetriever(documents, alpha=0.5)
+    
+    for retriever in (hybrid.bm25_retriever, hybrid.dense_retriever, hybrid):
+        batch = retriever.retrieve_batch(queries, top_k=5)
+        for query, results in zip(queries, batch):
+            single = retriever.retrieve(query, top_k=5)
+            assert [idx for idx, _ in results] == [idx for idx, _ in single]
+            assert np.allclose([s for _, s in results], [s for _, s in single], atol=1e-5)
+    
+    print("retrieve_batch matches per-query retrieve")
+
+
 def test_ore():
     documents, queries = create_mock_data()
     hybrid_retriever = HybridRetriever(documents)
@@ -89,12 +255,451 @@ def test_ore():
         print(f"  {i}. [Score: {score:.3f}] {documents[doc_idx]}")
 
 
+def test_ore_array_scores():
+    documents, queries = create_mock_data()
+    initial_scores = np.zeros(len(documents), dtype=np.float32)
+    initial_scores[[0, 2, 4]] = [0.9, 0.5, 0.1]
+    
+    def rerank_model(query, doc_indices):
+        return {doc_idx: 1.0 - doc_idx / len(documents) for doc_idx in doc_indices}
+    
+    rankings = []
+    for scores in (initial_scores, {i: float(s) for i, s in enumerate(initial_scores)}):
+        ore = OnlineRelevanceEstimation(documents, scores, rerank_model, batch_size=2, exploration_factor=0.2)
+        rankings.append(ore.rerank(queries[0], budget=4))
+        assert ore.reranked[[0, 2]].all() and not ore.reranked[4]
+    
+    assert [idx for idx, _ in rankings[0]] == [idx for idx, _ in rankings[1]]
+    assert np.allclose([s for _, s in rankings[0]], [s for _, s in rankings[1]])
+    assert sorted(idx for idx, _ in rankings[0]) == list(range(len(documents)))
+    print("\nArray-backed ORE matches dict-backed ORE")
+
+
+def test_ore_incremental_selection():
+    rng = np.random.default_rng(0)
+    initial_scores = np.zeros(3000, dtype=np.float32)
+    initial_scores[rng.choice(3000, 500, replace=False)] = rng.random(500)
+    documents = [""] * len(initial_scores)
+    ore = OnlineRelevanceEstimation(documents, initial_scores, batch_size=7, exploration_factor=0.3)
+    
+    for _ in range(30):
+        scores = ore.current_scores
+        score_range = scores.max() - scores.min() if scores.max() > scores.min() else 1.0
+        normalized = (scores - scores.min()) / score_range
+        ucb = normalized + np.where(ore.reranked, 0.0, 0.3 * (1.0 - normalized))
+        expected = np.argsort(-ucb, kind='stable')[:7].tolist()
+        
+        batch = ore.select_batch("query")
+        assert batch == expected
+        ore.update_scores(batch, {doc_idx: float(rng.random()) for doc_idx in batch})
+    print("\nIncremental ORE selection matches a full scan")
+
+
+def test_ore_lazy_propagation():
+    initial_scores = np.array([0.5, 0.2, 0.1, 0.0], dtype=np.float32)
+    ore = OnlineRelevanceEstimation([""] * 4, initial_scores, batch_size=1)
+    
+    ore.update_scores([0], {0: 0.9})
+    ore.update_scores([1], {1: 0.6})
+    
+    assert np.allclose(ore.get_scores([0, 1]), [0.9, 0.6])
+    assert np.allclose(ore.get_scores([2, 3]), [0.1 + 0.4 * 0.03 + 0.388 * 0.03, 0.4 * 0.03 + 0.388 * 0.03])
+    assert np.allclose(ore.current_scores, ore.get_scores([0, 1, 2, 3]))
+    print("\nLazy ORE propagation boosts only documents that were not reranked")
+
+
+def test_ore_candidate_pool():
+    rng = np.random.default_rng(1)
+    candidates = rng.choice(500, 40, replace=False)
+    initial_scores = {int(idx): float(score) for idx, score in zip(candidates, rng.random(40))}
+    full_scores = np.zeros(500, dtype=np.float32)
+    full_scores[candidates] = list(initial_scores.values())
+    
+    def rerank_model(query, doc_indices):
+        return {doc_idx: (doc_idx * 7919 % 100) / 100 for doc_idx in doc_indices}
+    
+    full = OnlineRelevanceEstimation([""] * 500, full_scores, rerank_model, batch_size=8, exploration_factor=0.2)
+    pool = OnlineRelevanceEstimation([""] * 500, initial_scores, rerank_model, batch_size=8, exploration_factor=0.2,
+                                     corpus_size=500)
+    
+    expected = full.rerank("query", budget=60)
+    assert pool.rerank("query", budget=60, depth=50) == expected[:50]
+    assert len(pool.base_scores) < 100
+    print("\nCandidate-pool ORE matches full-corpus ORE")
+
+
+def test_ore_pipelined():
+    rng = np.random.default_rng(2)
+    initial_scores = {int(idx): float(score) for idx, score in zip(rng.choice(1000, 100, replace=False), rng.random(100))}
+    batches = []
+    
+    def rerank_model(query, doc_indices):
+        batches.append(doc_indices)
+        return {doc_idx: (doc_idx % 10) / 10 for doc_idx in doc_indices}
+    
+    ore = OnlineRelevanceEstimation([""] * 1000, initial_scores, rerank_model, batch_size=5,
+                                    corpus_size=1000, max_in_flight=3)
+    ranking = ore.rerank("query", budget=42, depth=20)
+    
+    assert sum(len(batch) for batch in batches) == 42
+    assert all(len(set(batch)) == len(batch) for batch in batches)
+    assert len(ranking) == 20
+    
+    def run(**kwargs):
+        batches.clear()
+        ore = OnlineRelevanceEstimation([""] * 1000, initial_scores, rerank_model, batch_size=5,
+                                        corpus_size=1000, **kwargs)
+        return ore.rerank("query", budget=42, depth=20), [list(batch) for batch in batches]
+    
+    assert run(max_in_flight=3, sync=True) == run(max_in_flight=1)
+    print("\nPipelined ORE respects the budget")
+
+
+def test_cross_encoder_reranker():
+    documents, queries = create_mock_data()
+    reranker = CrossEncoderReranker(documents, batch_size=4, cache_size=8)
+    
+    scores = reranker(queries[0], [3, 0, 7])
+    assert sorted(scores) == [0, 3, 7]
+    assert reranker.misses == 3 and reranker.hits == 0
+    
+    again = reranker(queries[0], [7, 3])
+    assert again == {7: scores[7], 3: scores[3]}
+    assert reranker.hits == 2
+    
+    reranker.score_pairs([(queries[1], idx) for idx in range(len(documents))])
+    assert len(reranker.cache) == 8
+    
+    initial_scores = {idx: score for idx, score in HybridRetriever(documents).retrieve(queries[0], top_k=10)}
+    ore = OnlineRelevanceEstimation(documents, initial_scores, reranker, batch_size=3)
+    final_ranking = ore.rerank(queries[0], budget=6)
+    print(f"\nCross-encoder ORE top document: {documents[final_ranking[0][0]]}")
+
+
+def test_rerank_many():
+    documents, queries = create_mock_data()
+    retriever = HybridRetriever(documents)
+    reranker = CrossEncoderReranker(documents)
+    calls = []
+    score_batches = reranker.score_batches
+    
+    def counting_score_batches(requests):
+        calls.append(len(requests))
+        return score_batches(requests)
+    reranker.score_batches = counting_score_batches
+    
+    def make_ores():
+        return [
+            OnlineRelevanceEstimation(documents, dict(retriever.retrieve(query, top_k=8)), reranker,
+                                      batch_size=3, corpus_size=len(documents))
+            for query in queries
+        ]
+    
+    rankings = rerank_many(make_ores(), queries, budget=7, depth=5)
+    assert calls == [len(queries)] * 3
+    
+    expected = [ore.rerank(query, budget=7, depth=5) for ore, query in zip(make_ores(), queries)]
+    assert [[idx for idx, _ in ranking] for ranking in rankings] == [[idx for idx, _ in ranking] for ranking in expected]
+    print("\nMulti-query ORE matches per-query ORE with one reranker call per round")
+
+
+def test_dense_blend_reranker():
+    documents, queries = create_mock_data()
+    dense_retriever = DenseRetriever(documents)
+    current = np.array([0.1, 0.5, 0.7, 0.9, 0.95, 0.0, 0.2, 0.4, 0.6, 0.8], dtype=np.float32)
+    reranker = DenseBlendReranker(dense_retriever)
+    
+    def current_scores(doc_indices):
+        return current[doc_indices]
+    
+    batch = [0, 3, 4, 8]
+    scores = reranker(queries[0], batch, current_scores=current_scores)
+    embeddings = dense_retriever.doc_embeddings[batch]
+    query_embedding = dense_retriever.encode_queries([queries[0]])[0]
+    dense = embeddings @ query_embedding / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding))
+    norm_dense = (dense - dense.min()) / (dense.max() - dense.min())
+    expected = [0.2 * 0.1 + 0.8 * norm_dense[0], 0.85 * 0.9 + 0.15 * norm_dense[1],
+                0.85 * 0.95 + 0.15 * norm_dense[2], 0.6 * 0.6 + 0.4 * norm_dense[3]]
+    expected = np.maximum(expected, current[batch])
+    assert np.allclose([scores[idx] for idx in batch], expected, atol=1e-5)
+    
+    batched = reranker.score_batches([(queries[0], batch), (queries[1], []), (queries[1], [1, 2])],
+                                     [current_scores, current_scores, None])
+    assert batched[0] == scores and batched[1] == {}
+    assert batched[2] == reranker(queries[1], [1, 2])
+    
+    # Two queries with the same text blend against their own ORE's scores.
+    def make_ores():
+        return [
+            OnlineRelevanceEstimation(documents, {idx: 1.0 - idx / 10 for idx in range(10)}, reranker, batch_size=3,
+                                      corpus_size=len(documents)),
+            OnlineRelevanceEstimation(documents, {idx: idx / 10 for idx in range(5, 15)}, reranker, batch_size=3,
+                                      corpus_size=len(documents))
+        ]
+    expected = [ore.rerank(queries[0], budget=6, depth=5) for ore in make_ores()]
+    assert rerank_many(make_ores(), [queries[0], queries[0]], budget=6, depth=5) == expected
+    print("\nDense blend reranker matches the piecewise blend")
+
+
+def test_run_ore_parallel():
+    documents = [""] * 200
+    rng = np.random.default_rng(3)
+    tasks = [
+        (f"query {i}", {int(idx): float(score) for idx, score in zip(rng.choice(200, 30, replace=False), rng.random(30))})
+        for i in range(7)
+    ]
+    
+    def rerank_model(query, doc_indices):
+        offset = int(query.split()[1])
+        return {doc_idx: ((doc_idx + offset) % 13) / 13 for doc_idx in doc_indices}
+    
+    context = dict(documents=documents, rerank_model=rerank_model, budget=12, top_k=10, batch_size=4,
+                   exploration_factor=0.2, in_flight=1)
+    expected = run_ore_parallel(tasks, workers=1, **context)
+    assert len(expected) == len(tasks) and len({tuple(ranking) for ranking in expected}) == len(tasks)
+    for workers in (2, 3):
+        assert run_ore_parallel(tasks, workers=workers, num_threads=1, **context) == expected
+    print("\nParallel ORE returns every query's ranking in task order")
+
+
+def test_sweep():
+    values = {"alpha": [0.3, 0.7], "budget": [10, 20], "batch_size": [5], "exploration": [0.1, 0.2]}
+    grid = sweep_configs(values)
+    assert len(grid) == 8 and len({tuple(config.values()) for config in grid}) == 8
+    assert grid[0] == {"alpha": 0.3, "budget": 10, "batch_size": 5, "exploration": 0.1}
+    assert all(set(config) == set(SWEEP_PARAMETERS) for config in grid)
+    
+    sampled = sweep_configs(values, search="random", trials=3, seed=1)
+    assert len(sampled) == 3 and all(config in grid for config in sampled)
+    assert sampled == sweep_configs(values, search="random", trials=3, seed=1)
+    assert len(sweep_configs(values, search="random", trials=100)) == 8
+    
+    documents, queries = create_mock_data()
+    retriever = HybridRetriever(documents)
+    prepared = []
+    for query in queries[:3]:
+        initial_results = retriever.retrieve(query, top_k=8)
+        relevant_indices = {initial_results[-1][0]}
+        baseline = evaluate_ranking([idx for idx, _ in initial_results[:5]], relevant_indices, 5)
+        prepared.append((query, relevant_indices, baseline, normalize_initial_scores(initial_results)))
+    
+    def rerank_model(query, doc_indices):
+        return {doc_idx: 1.0 - doc_idx / len(documents) for doc_idx in doc_indices}
+    
+    rows = run_sweep(sweep_configs({**values, "alpha": [0.5]})[:2], prepared={0.5: prepared}, documents=documents,
+                     rerank_model=rerank_model, top_k=5)
+    assert len(rows) == 2
+    for row in rows:
+        assert set(row) == set(SWEEP_PARAMETERS) | {f"{name}_{metric}" for name in ("baseline", "ore") for metric in METRICS} \
+            | {"queries", "seconds"}
+        assert row["queries"] == 3 and 0.0 <= row["ore_ndcg"] <= 1.0
+    print("\nSweep configurations and result rows have the expected shape")
+
+
+def test_run_files():
+    rankings = {"q1": [("d3", 2.5), ("d1", 1.0 / 3)], "q2": [("d2", -0.25)]}
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+        path = run_path(tmp_dir, "first-stage", "msmarco-passage/trec-dl-2019", 100, alpha=0.5, fusion="minmax")
+        assert path != run_path(tmp_dir, "first-stage", "msmarco-passage/trec-dl-2019", 100, alpha=0.3, fusion="minmax")
+        write_run(path, rankings, tag="test", config={"alpha": 0.5})
+        assert read_run(path) == rankings
+        with open(path, encoding='utf-8') as f:
+            assert f.readline() == "q1 Q0 d3 1 2.5 test\n"
+    print("\nRun files round-trip rankings and scores")
+
+
+def test_document_store():
+    documents, queries = create_mock_data()
+    documents = documents + ["Caf\u00e9 cr\u00e8me br\u00fbl\u00e9e", ""]
+    doc_ids = [f"D{len(documents) - i}" for i in range(len(documents))]
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+        build_document_store(tmp_dir + "/store", zip(doc_ids, documents), key="k1")
+        assert load_document_store(tmp_dir + "/store", key="k2") is None
+        store = load_document_store(tmp_dir + "/store", key="k1")
+        
+        assert len(store) == len(documents) and list(store) == documents
+        assert store[-2] == documents[-2] and store[3:7] == documents[3:7] and store[::5] == documents[::5]
+        assert all(store.index[doc_id] == row for row, doc_id in enumerate(doc_ids))
+        assert list(store.index) == doc_ids and "D0" not in store.index and "D999" not in store.index
+        
+        bm25 = BM25Retriever(store)
+        assert bm25.retrieve(queries[0], top_k=5) == BM25Retriever(documents).retrieve(queries[0], top_k=5)
+    print("\nDocument store serves the same documents as the list")
+
+
+def test_dataset_loader_relevant_documents():
+    documents, _ = create_mock_data()
+    doc_ids = [f"D{i}" for i in range(len(documents))]
+    calls = {"docs_iter": 0, "get_many_iter": []}
+    
+    class FakeDocstore:
+        def get_many_iter(self, requested):
+            # Like ir_datasets' lookup: yields in on-disk order, skips unknown ids.
+            calls["get_many_iter"].append(list(requested))
+            for doc_id, text in zip(doc_ids, documents):
+                if doc_id in requested:
+                    yield SimpleNamespace(doc_id=doc_id, text=text)
+        
+        def get(self, doc_id):
+            for doc in self.get_many_iter([doc_id]):
+                return doc
+            raise KeyError(doc_id)
+    
+    class FakeDataset:
+        def docs_iter(self):
+            calls["docs_iter"] += 1
+            return (SimpleNamespace(doc_id=doc_id, text=text) for doc_id, text in zip(doc_ids, documents))
+        
+        def docs_store(self):
+            return FakeDocstore()
+    
+    def make_loader(data_dir):
+        loader = DatasetLoader("msmarco-passage/trec-dl-2019/judged", data_dir=data_dir)
+        loader.dataset = FakeDataset()
+        return loader
+    
+    ir_datasets_home = os.environ.get("IR_DATASETS_HOME")
+    try:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+            loader = make_loader(tmp_dir)
+            found = loader.get_documents(["D9", "D2", "missing", "D9"])
+            assert list(found.items()) == [("D9", documents[9]), ("D2", documents[2])]
+            assert calls["get_many_iter"] == [["D2", "D9", "missing"]]
+            assert loader.get_document_by_id("missing") is None
+            
+            calls["get_many_iter"].clear()
+            docs, doc_index = loader.load_documents(limit=3, include_relevant_doc_ids={"D12", "D1", "D7", "missing"})
+            # Judged documents outside the sample follow it in sorted id order.
+            assert docs == documents[:3] + [documents[12], documents[7]]
+            assert doc_index == {"D0": 0, "D1": 1, "D2": 2, "D12": 3, "D7": 4}
+            assert calls["docs_iter"] == 1 and len(calls["get_many_iter"]) == 1
+            assert loader.load_documents(limit=3, include_relevant_doc_ids={"D12", "D1", "D7", "missing"})[0] is docs
+            
+            # A new loader reads the same corpus back from disk without touching the collection.
+            reloaded = make_loader(tmp_dir)
+            assert reloaded.load_documents(limit=3, include_relevant_doc_ids={"D12", "D1", "D7", "missing"}) == (docs, doc_index)
+            assert calls["docs_iter"] == 1
+            
+            other, other_index = reloaded.load_documents(limit=3, include_relevant_doc_ids={"D5"})
+            assert calls["docs_iter"] == 2
+            assert other == documents[:3] + [documents[5]] and other_index["D5"] == 3
+    finally:
+        if ir_datasets_home is not None:
+            os.environ["IR_DATASETS_HOME"] = ir_datasets_home
+    print("\nJudged documents are fetched in one bulk read and the corpus is cached on disk")
+
+
+def test_streaming_ingestion():
+    documents, queries = create_mock_data()
+    doc_ids = [f"D{i}" for i in range(len(documents))]
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(documents), 8)).astype(np.float32)
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp_dir:
+        store_writer = DocumentStoreWriter(tmp_dir + "/store")
+        builder = InvertedIndexBuilder()
+        embedding_writer = EmbeddingWriter(tmp_dir + "/staging", 8, capacity=2)
+        chunks = []
+        
+        def index_chunk(chunk_ids, texts):
+            builder.add(tokenize(text) for text in texts)
+        
+        def encode_chunk(chunk_ids, texts):
+            chunks.append(len(texts))
+            embedding_writer.append(vectors[[int(doc_id[1:]) for doc_id in chunk_ids]])
+        
+        num_docs = ingest(zip(doc_ids, documents), [store_writer.add, index_chunk, encode_chunk], chunk_size=3)
+        assert num_docs == len(documents) and max(chunks) == 3
+        
+        store = store_writer.close("k")
+        assert list(store) == documents and store.fingerprint == build_document_store(
+            tmp_dir + "/store2", zip(doc_ids, documents)).fingerprint
+        index, reference = builder.build(), build_index(tokenize(doc) for doc in documents)
+        for query in queries:
+            assert all(np.array_equal(a, b) for a, b in zip(index.top_k(tokenize(query), 5),
+                                                            reference.top_k(tokenize(query), 5)))
+        cache = embedding_writer.close(tmp_dir + "/embeddings", "k")
+        assert cache.is_complete and np.array_equal(cache.load(), vectors)
+        
+        # An interrupted writer keeps its rows for a writer reopened with the same key.
+        interrupted = EmbeddingWriter(tmp_dir + "/resume", 8, key="run")
+        interrupted.append(vectors[:6])
+        del interrupted
+        assert EmbeddingWriter(tmp_dir + "/other", 8, key="run").rows == 0
+        resumed = EmbeddingWriter(tmp_dir + "/resume", 8, key="run")
+        assert resumed.rows == 6
+        resumed.append(vectors[6:])
+        assert np.array_equal(resumed.close(tmp_dir + "/resumed", "k").load(), vectors)
+        assert EmbeddingWriter(tmp_dir + "/resume", 8, key="other").rows == 0
+    print("\nStreaming ingestion matches the list-based builds")
+
+
+def test_bm25_parallel_build():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise unittest.SkipTest("the sharded build needs the 'fork' start method")
+    documents, queries = create_mock_data()
+    serial = build_index(tokenize(doc) for doc in documents)
+    parallel = build_index_parallel(documents, workers=2, shard_size=4)
+    assert parallel.vocab == serial.vocab and list(parallel.vocab) == list(serial.vocab)
+    for name in INDEX_ARRAYS:
+        assert np.array_equal(getattr(parallel, name), getattr(serial, name))
+    
+    bm25 = BM25Retriever(documents, workers=2)
+    for query in queries:
+        assert bm25.retrieve(query, top_k=5) == BM25Retriever(documents).retrieve(query, top_k=5)
+    print("\nSharded BM25 build matches the single-process index")
+
+
+def test_dense_length_sorted_encoding():
+    documents, _ = create_mock_data()
+    dense_retriever = DenseRetriever(documents, batch_size=4)
+    reference = dense_retriever.model.encode(documents, convert_to_numpy=True)
+    assert np.allclose(dense_retriever.doc_embeddings[np.arange(len(documents))], reference, atol=1e-5)
+    assert np.allclose(encode_documents(dense_retriever.model, documents[::-1], batch_size=3), reference[::-1], atol=1e-5)
+    assert encode_documents(dense_retriever.model, []).shape == (0, reference.shape[1])
+    
+    thread_limits = {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")}
+    pool = start_encode_pool(dense_retriever.model, 2)
+    assert {name: os.environ.get(name) for name in thread_limits} == thread_limits
+    try:
+        pooled = encode_documents(dense_retriever.model, documents, batch_size=4, pool=pool)
+    finally:
+        stop_encode_pool(dense_retriever.model, pool)
+    assert np.allclose(pooled, reference, atol=1e-5)
+    print("\nLength-sorted encoding restores the document order")
+
+
 if __name__ == "__main__":
     try:
         test_bm25()
+        test_bm25_index_matches_rank_bm25()
+        test_bm25_pruning_matches_exhaustive()
+        test_bm25_index_persistence()
         test_dense()
+        test_dense_embedding_cache()
+        test_dense_reduced_precision()
+        test_dense_ann()
         test_hybrid()
+        test_hybrid_shares_components()
+        test_hybrid_fusion_modes()
+        test_retrieve_batch()
         test_ore()
+        test_ore_array_scores()
+        test_ore_incremental_selection()
+        test_ore_lazy_propagation()
+        test_ore_candidate_pool()
+        test_ore_pipelined()
+        test_cross_encoder_reranker()
+        test_rerank_many()
+        test_dense_blend_reranker()
+        test_run_ore_parallel()
+        test_sweep()
+        test_run_files()
+        test_document_store()
+        test_dataset_loader_relevant_documents()
+        test_streaming_ingestion()
+        if "fork" in multiprocessing.get_all_start_methods():
+            test_bm25_parallel_build()
+        test_dense_length_sorted_encoding()
         print("\nAll tests completed!")
     except Exception as e:
         print(f"Error: {e}")